@@ -0,0 +1,76 @@
+"""
+CPU/GPU inference latency of trained students (e.g. GR_weight/*_best.pth), as trained and
+with the conv-BN pairs folded by helper.fuse.inference_fuse
+"""
+
+from __future__ import print_function
+
+import argparse
+
+import torch
+
+from models import model_dict
+from dataset.cifar100 import get_cifar100_dataloaders
+from helper.fuse import inference_fuse, measure_latency
+from helper.deploy import get_model_name, load_model
+from helper.loops import validate
+
+
+def parse_option():
+
+    parser = argparse.ArgumentParser('argument for inference benchmark')
+
+    parser.add_argument('--path', type=str, nargs='+', required=True, help='model snapshot(s)')
+    parser.add_argument('--model', type=str, default=None, choices=list(model_dict.keys()),
+                        help='architecture, parsed from the snapshot name when omitted')
+    parser.add_argument('--batch_size', type=int, default=1, help='batch size of the timed forwards')
+    parser.add_argument('--n_iter', type=int, default=100, help='timed forwards per model')
+    parser.add_argument('--threads', type=int, default=None, help='torch CPU threads')
+    parser.add_argument('--cuda', action='store_true', help='time on the GPU instead of the CPU')
+    parser.add_argument('--fused_shuffle', action='store_true', help='ShuffleV1: relu + channel shuffle as one pass, other models are timed as they are')
+    parser.add_argument('--no_fuse', dest='fuse', action='store_false', help='only time the model as trained')
+    parser.add_argument('--validate', action='store_true', help='also report CIFAR-100 test accuracy')
+    parser.add_argument('--num_workers', type=int, default=4, help='num of workers of --validate')
+
+    opt = parser.parse_args()
+
+    # read by helper.loops.validate
+    opt.dali = None
+    opt.gpu = 0 if opt.cuda else None
+    opt.multiprocessing_distributed = False
+    opt.print_freq = 1000000
+    opt.fuse_eval = False
+
+    return opt
+
+
+def main():
+    opt = parse_option()
+    if opt.threads is not None:
+        torch.set_num_threads(opt.threads)
+    device = torch.device('cuda' if opt.cuda else 'cpu')
+    x = torch.randn(opt.batch_size, 3, 32, 32, device=device)
+    val_loader = None
+    if opt.validate:
+        _, val_loader = get_cifar100_dataloaders(batch_size=256, num_workers=opt.num_workers)
+    criterion = torch.nn.CrossEntropyLoss()
+
+    for path in opt.path:
+        model_name = opt.model or get_model_name(path)
+        model = load_model(path, model_name).to(device)
+        if opt.fused_shuffle and model_name == 'ShuffleV1':
+            model.fuse_shuffle()
+        models = [('eager', model)]
+        if opt.fuse:
+            models.append(('fused', inference_fuse(models[0][1], x)))
+        for tag, model in models:
+            latency = measure_latency(model, x, n_iter=opt.n_iter)
+            line = '{} [{}] {}: {:.3f} ms/batch of {}'.format(path, model_name, tag, latency * 1e3, opt.batch_size)
+            if val_loader is not None:
+                acc, acc_top5, _ = validate(val_loader, model, criterion, opt)
+                line += ', Acc@1 {:.2f} Acc@5 {:.2f}'.format(float(acc), float(acc_top5))
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,12 +19,15 @@ class CRDLoss(nn.Module):
         opt.nce_t: the temperature
         opt.nce_m: the momentum for updating the memory buffer
         opt.n_data: the number of samples in the training set, therefor the memory buffer is: opt.n_data x opt.feat_dim
+        opt.nce_bank_dtype: storage dtype of the memory buffer
+        opt.nce_bank_path: if set, the memory buffer is a memory-mapped file in this directory
     """
     def __init__(self, opt):
         super(CRDLoss, self).__init__()
         self.embed_s = Embed(opt.s_dim, opt.feat_dim)
         self.embed_t = Embed(opt.t_dim, opt.feat_dim)
-        self.contrast = ContrastMemory(opt.feat_dim, opt.n_data, opt.nce_k, opt.nce_t, opt.nce_m)
+        self.contrast = ContrastMemory(opt.feat_dim, opt.n_data, opt.nce_k, opt.nce_t, opt.nce_m,
+                                       bank_dtype=opt.nce_bank_dtype, bank_path=opt.nce_bank_path)
         self.criterion_t = ContrastLoss(opt.n_data)
         self.criterion_s = ContrastLoss(opt.n_data)
 
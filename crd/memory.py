@@ -1,134 +1,258 @@
+import os
+import math
+
+import numpy as np
 import torch
 from torch import nn
-import math
+import torch.nn.functional as F
+
+
+# scores of the whole batch against the whole memory are formed when there are at most
+# this many of them, a single GEMM being much cheaper than gathering K+1 rows per sample
+DENSE_SCORES = 1 << 24
+
+
+def _gather_rows(memory, rows, v):
+    """memory[rows] (batch x n x feat_dim) on the device and in the dtype of v"""
+    weight = torch.index_select(memory, 0, rows.reshape(-1)).view(rows.shape[0], rows.shape[1], -1)
+    return weight.to(device=v.device, dtype=v.dtype, non_blocking=True)
+
+
+class GatherDot(torch.autograd.Function):
+    """
+    out[b, k] = <memory[idx[b, k]], v[b]> without materializing (or keeping for backward)
+    the batch x (K+1) x feat_dim gathered weights.
+
+    Small memories are scored with one batch x outputSize GEMM followed by a gather, larger
+    ones (or a memory on another device, see ContrastMemory bank_path) by gathering chunks of
+    `chunk` negatives at a time. The gradient w.r.t. v is the matching scatter + GEMM, a single
+    embedding_bag over the same rows, or the chunked gather again for reduced-precision banks.
+    """
+    @staticmethod
+    def forward(ctx, memory, idx, v, chunk):
+        bsz = idx.shape[0]
+        ctx.chunk = chunk
+        ctx.dense = memory.device == v.device and memory.shape[0] * bsz <= DENSE_SCORES
+        if ctx.dense:
+            out = torch.mm(v, memory.t().to(v.dtype)).gather(1, idx)
+        else:
+            rows_idx = idx.to(memory.device)
+            out = v.new_empty(idx.shape)
+            for start in range(0, idx.shape[1], chunk):
+                weight = _gather_rows(memory, rows_idx[:, start:start + chunk], v)
+                out[:, start:start + chunk] = torch.bmm(weight, v.unsqueeze(2)).squeeze(2)
+        ctx.save_for_backward(memory, idx)
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        memory, idx = ctx.saved_tensors
+        if ctx.dense:
+            grad_scores = grad_out.new_zeros(idx.shape[0], memory.shape[0]).scatter_add_(1, idx, grad_out)
+            grad_v = torch.mm(grad_scores, memory.to(grad_out.dtype))
+        elif memory.device == grad_out.device and memory.dtype == grad_out.dtype:
+            grad_v = F.embedding_bag(idx, memory, per_sample_weights=grad_out, mode='sum')
+        else:
+            rows_idx = idx.to(memory.device)
+            grad_v = grad_out.new_zeros(idx.shape[0], memory.shape[1])
+            for start in range(0, idx.shape[1], ctx.chunk):
+                weight = _gather_rows(memory, rows_idx[:, start:start + ctx.chunk], grad_out)
+                grad_v += torch.bmm(grad_out[:, None, start:start + ctx.chunk], weight).squeeze(1)
+        return None, None, grad_v, None
+
+
+def open_bank(path, shape, dtype, init):
+    """
+    n_data x feat_dim bank backed by a .npy file opened as a writable memory map
+
+    An existing file of the right shape and dtype is reopened as is (e.g. to resume),
+    otherwise it is created and filled row-chunk by row-chunk with init(n_rows).
+    """
+    if os.path.isfile(path):
+        array = np.load(path, mmap_mode='r+')
+        if array.shape == tuple(shape) and array.dtype == np.dtype(dtype):
+            return torch.from_numpy(array)
+    array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+    step = 1 << 16
+    for start in range(0, shape[0], step):
+        n_rows = min(step, shape[0] - start)
+        array[start:start + n_rows] = init(n_rows).numpy()
+    array.flush()
+    return torch.from_numpy(array)
 
 
 class ContrastMemory(nn.Module):
     """
     memory buffer that supplies large amount of negative samples.
+
+    K, T and momentum are plain attributes and the normalization constants stay on the
+    device (params[2:4]), so forward never synchronizes with the host. The momentum update
+    of a batch is applied at the start of the next forward (or before saving), i.e. after
+    the backward pass that still needs the old rows, which gives the same values as the
+    eager update but lets the scores be recomputed from the memory in backward.
+
+    Args:
+        bank_dtype: storage dtype of memory_v1/memory_v2, 'float32', 'float16' or 'bfloat16';
+            momentum updates are done in float32 on the touched rows
+        bank_path: if given, the banks are .npy files in this directory, memory-mapped on the
+            host (they stay there when the module is moved to the GPU) and never part of the
+            state_dict; 'bfloat16' has no numpy equivalent and is not supported here
     """
-    def __init__(self, inputSize, outputSize, K, T=0.07, momentum=0.5):
+    def __init__(self, inputSize, outputSize, K, T=0.07, momentum=0.5, chunk=256,
+                 bank_dtype='float32', bank_path=None):
         super(ContrastMemory, self).__init__()
         self.nLem = outputSize
         self.unigrams = torch.ones(self.nLem)
         self.multinomial = AliasMethod(self.unigrams)
-        self.multinomial.cuda()
         self.K = K
+        self.T = T
+        self.momentum = momentum
+        # negatives gathered per step of GatherDot when the memory is too large to score densely
+        self.chunk = chunk
 
+        # K, T and momentum are kept in params for checkpoint compatibility, only Z is read back
         self.register_buffer('params', torch.tensor([K, T, -1, -1, momentum]))
         stdv = 1. / math.sqrt(inputSize / 3)
-        self.register_buffer('memory_v1', torch.rand(outputSize, inputSize).mul_(2 * stdv).add_(-stdv))
-        self.register_buffer('memory_v2', torch.rand(outputSize, inputSize).mul_(2 * stdv).add_(-stdv))
 
-    def forward(self, v1, v2, y, idx=None):
-        K = int(self.params[0].item())
-        T = self.params[1].item()
-        Z_v1 = self.params[2].item()
-        Z_v2 = self.params[3].item()
+        def init(n_rows):
+            return torch.rand(n_rows, inputSize).mul_(2 * stdv).add_(-stdv)
+
+        if bank_path is None:
+            dtype = getattr(torch, bank_dtype)
+            self.register_buffer('memory_v1', init(outputSize).to(dtype))
+            self.register_buffer('memory_v2', init(outputSize).to(dtype))
+        else:
+            if bank_dtype not in ['float32', 'float16']:
+                raise ValueError('a memory-mapped CRD bank is float32 or float16, not {}'.format(bank_dtype))
+            if not os.path.isdir(bank_path):
+                os.makedirs(bank_path)
+            self.memory_v1 = open_bank(os.path.join(bank_path, 'memory_v1.npy'), (outputSize, inputSize), bank_dtype, init)
+            self.memory_v2 = open_bank(os.path.join(bank_path, 'memory_v2.npy'), (outputSize, inputSize), bank_dtype, init)
+        self._pending = None
+        self._z_checked = False
 
-        momentum = self.params[4].item()
+    def forward(self, v1, v2, y, idx=None):
+        self.flush()
         batchSize = v1.size(0)
         outputSize = self.memory_v1.size(0)
-        inputSize = self.memory_v1.size(1)
 
         # original score computation
         if idx is None:
-            idx = self.multinomial.draw(batchSize * (self.K + 1)).view(batchSize, -1)
+            idx = self.multinomial.draw(batchSize * (self.K + 1), device=y.device).view(batchSize, -1)
             idx.select(1, 0).copy_(y.data)
         # sample
-        weight_v1 = torch.index_select(self.memory_v1, 0, idx.view(-1)).detach()
-        weight_v1 = weight_v1.view(batchSize, K + 1, inputSize)
-        out_v2 = torch.bmm(weight_v1, v2.view(batchSize, inputSize, 1))
-        out_v2 = torch.exp(torch.div(out_v2, T))
-        # sample
-        weight_v2 = torch.index_select(self.memory_v2, 0, idx.view(-1)).detach()
-        weight_v2 = weight_v2.view(batchSize, K + 1, inputSize)
-        out_v1 = torch.bmm(weight_v2, v1.view(batchSize, inputSize, 1))
-        out_v1 = torch.exp(torch.div(out_v1, T))
-
-        # set Z if haven't been set yet
-        if Z_v1 < 0:
-            self.params[2] = out_v1.mean() * outputSize
-            Z_v1 = self.params[2].clone().detach().item()
-            print("normalization constant Z_v1 is set to {:.1f}".format(Z_v1))
-        if Z_v2 < 0:
-            self.params[3] = out_v2.mean() * outputSize
-            Z_v2 = self.params[3].clone().detach().item()
-            print("normalization constant Z_v2 is set to {:.1f}".format(Z_v2))
-
-        # compute out_v1, out_v2
-        out_v1 = torch.div(out_v1, Z_v1).contiguous()
-        out_v2 = torch.div(out_v2, Z_v2).contiguous()
-
-        # update memory
-        with torch.no_grad():
-            l_pos = torch.index_select(self.memory_v1, 0, y.view(-1))
-            l_pos.mul_(momentum)
-            l_pos.add_(torch.mul(v1, 1 - momentum))
-            l_norm = l_pos.pow(2).sum(1, keepdim=True).pow(0.5)
-            updated_v1 = l_pos.div(l_norm)
-            self.memory_v1.index_copy_(0, y, updated_v1)
-
-            ab_pos = torch.index_select(self.memory_v2, 0, y.view(-1))
-            ab_pos.mul_(momentum)
-            ab_pos.add_(torch.mul(v2, 1 - momentum))
-            ab_norm = ab_pos.pow(2).sum(1, keepdim=True).pow(0.5)
-            updated_v2 = ab_pos.div(ab_norm)
-            self.memory_v2.index_copy_(0, y, updated_v2)
+        out_v2 = torch.exp(torch.div(GatherDot.apply(self.memory_v1, idx, v2, self.chunk), self.T))
+        out_v1 = torch.exp(torch.div(GatherDot.apply(self.memory_v2, idx, v1, self.chunk), self.T))
+
+        # set Z if haven't been set yet, the only host sync, on the first forward
+        if not self._z_checked:
+            with torch.no_grad():
+                self.params[2] = torch.where(self.params[2] < 0, out_v1.mean() * outputSize, self.params[2])
+                self.params[3] = torch.where(self.params[3] < 0, out_v2.mean() * outputSize, self.params[3])
+            print("normalization constants Z_v1, Z_v2 are {:.1f}, {:.1f}".format(*self.params[2:4].tolist()))
+            self._z_checked = True
+
+        # compute out_v1, out_v2, batchSize x (K+1) x 1 as before
+        out_v1 = torch.div(out_v1, self.params[2]).unsqueeze(2)
+        out_v2 = torch.div(out_v2, self.params[3]).unsqueeze(2)
+
+        # update memory, deferred to the next forward
+        self._pending = (y.view(-1), v1.detach(), v2.detach())
 
         return out_v1, out_v2
 
+    @staticmethod
+    def _momentum_update(memory, y, v, momentum):
+        """memory[y] = normalize(momentum * memory[y] + (1 - momentum) * v), computed in float32"""
+        y = y.to(memory.device)
+        pos = torch.index_select(memory, 0, y).to(v.device, torch.float32)
+        pos.mul_(momentum)
+        pos.add_(torch.mul(v.float(), 1 - momentum))
+        norm = pos.pow(2).sum(1, keepdim=True).pow(0.5)
+        updated = pos.div(norm)
+        memory.index_copy_(0, y, updated.to(memory.device, memory.dtype))
+
+    def flush(self):
+        """apply the pending momentum update of the last batch to the memory"""
+        if self._pending is None:
+            return
+        y, v1, v2 = self._pending
+        self._pending = None
+        with torch.no_grad():
+            self._momentum_update(self.memory_v1, y, v1, self.momentum)
+            self._momentum_update(self.memory_v2, y, v2, self.momentum)
+
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        self.flush()
+        super(ContrastMemory, self)._save_to_state_dict(destination, prefix, keep_vars)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        self._pending = None
+        self._z_checked = False
+        super(ContrastMemory, self)._load_from_state_dict(*args, **kwargs)
+
 
 class AliasMethod(object):
     """
     From: https://hips.seas.harvard.edu/blog/2013/03/03/the-alias-method-efficient-sampling-with-many-discrete-outcomes/
+
+    The table is built with whole-tensor operations: a uniform distribution needs no
+    pairing at all, otherwise every round pairs all current small outcomes with large
+    ones at once (by matching cumulative deficits against cumulative excesses), which
+    takes a handful of rounds instead of a Python step per outcome.
     """
     def __init__(self, probs):
 
-        if probs.sum() > 1:
-            probs.div_(probs.sum())
         K = len(probs)
-        self.prob = torch.zeros(K)
-        self.alias = torch.LongTensor([0]*K)
-
-        # Sort the data into the outcomes with probabilities
-        # that are larger and smaller than 1/K.
-        smaller = []
-        larger = []
-        for kk, prob in enumerate(probs):
-            self.prob[kk] = K*prob
-            if self.prob[kk] < 1.0:
-                smaller.append(kk)
-            else:
-                larger.append(kk)
-
-        # Loop though and create little binary mixtures that
-        # appropriately allocate the larger outcomes over the
-        # overall uniform mixture.
-        while len(smaller) > 0 and len(larger) > 0:
-            small = smaller.pop()
-            large = larger.pop()
+        probs = torch.as_tensor(probs, dtype=torch.float64)
+        self.uniform = bool((probs == probs[0]).all())
+        self.alias = torch.arange(K)
+        if self.uniform:
+            self.prob = torch.ones(K)
+            return
 
+        q = probs * K / probs.sum()
+        resolved = torch.zeros(K, dtype=torch.bool)
+        smaller = (q < 1).nonzero().squeeze(1)
+        larger = (q >= 1).nonzero().squeeze(1)
+        while len(smaller) > 0 and len(larger) > 0:
+            # small s covers (deficit[s-1], deficit[s]] of the excess mass, large l owns
+            # (excess[l-1], excess[l]]; s is paired with the large its interval starts in
+            deficit = torch.cumsum(1 - q[smaller], 0)
+            excess = torch.cumsum(q[larger] - 1, 0)
+            owner = torch.searchsorted(excess, deficit - (1 - q[smaller]), right=True)
+            paired = owner < len(larger)
+            if not paired.any():
+                break
+            small, large = smaller[paired], larger[owner[paired]]
             self.alias[small] = large
-            self.prob[large] = (self.prob[large] - 1.0) + self.prob[small]
+            resolved[small] = True
+            # a large only drops below 1 when a small's interval crosses its end
+            q.index_add_(0, large, q[small] - 1)
+
+            smaller = torch.cat([smaller[~paired], larger[q[larger] < 1]])
+            larger = larger[q[larger] >= 1]
 
-            if self.prob[large] < 1.0:
-                smaller.append(large)
-            else:
-                larger.append(large)
+        # outcomes left over (only by rounding) are their own alias with probability 1
+        self.prob = torch.where(resolved, q.clamp(max=1), torch.ones_like(q)).float()
 
-        for last_one in smaller+larger:
-            self.prob[last_one] = 1
+    def to(self, device):
+        self.prob = self.prob.to(device)
+        self.alias = self.alias.to(device)
+        return self
 
     def cuda(self):
-        self.prob = self.prob.cuda()
-        self.alias = self.alias.cuda()
+        return self.to('cuda')
 
-    def draw(self, N):
-        """ Draw N samples from multinomial """
+    def draw(self, N, device=None):
+        """ Draw N samples from multinomial, on `device` (default: where the table is) """
+        if device is not None and self.prob.device != torch.device(device):
+            self.to(device)
         K = self.alias.size(0)
 
         kk = torch.zeros(N, dtype=torch.long, device=self.prob.device).random_(0, K)
+        if self.uniform:
+            return kk
         prob = self.prob.index_select(0, kk)
         alias = self.alias.index_select(0, kk)
         # b is whether a random number is greater than q
@@ -136,4 +260,4 @@ class AliasMethod(object):
         oq = kk.mul(b.long())
         oj = alias.mul((1-b).long())
 
-        return oq + oj
\ No newline at end of file
+        return oq + oj
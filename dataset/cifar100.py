@@ -1,7 +1,9 @@
 from __future__ import print_function
 
 import os
+import json
 import numpy as np
+import torch
 from torch.utils.data import DataLoader
 from torchvision import datasets, transforms
 from PIL import Image
@@ -28,10 +30,99 @@ def get_data_folder():
 
     return data_folder
 
+
+FAST_FOLDER = 'cifar-100-fast'
+
+
+def convert_cifar100(dataset):
+    """One-time conversion of a loaded CIFAR-100 split to the fast-start layout
+
+    {root}/cifar-100-fast/ holds {split}_data.npy (contiguous uint8 NxHxWxC),
+    {split}_targets.npy (int16) and {split}_manifest.json describing them.
+    Files are written under a private name and renamed, so concurrent trials
+    never open a partial array, and trials converting different splits at the
+    same time do not overwrite each other's manifest.
+    """
+    split = 'train' if dataset.train else 'test'
+    folder = os.path.join(dataset.root, FAST_FOLDER)
+    if not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+    arrays = {'data': np.ascontiguousarray(dataset.data, dtype=np.uint8),
+              'targets': np.asarray(dataset.targets, dtype=np.int16)}
+    for name, array in arrays.items():
+        path = os.path.join(folder, '{}_{}.npy'.format(split, name))
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        np.save(tmp_path, array)
+        os.replace(tmp_path + '.npy', path)
+
+    # written last, so a manifest only ever describes arrays that are complete
+    manifest_path = os.path.join(folder, '{}_manifest.json'.format(split))
+    manifest = {'format': 2, 'classes': dataset.classes, 'shape': list(arrays['data'].shape),
+                'dtype': 'uint8', 'label_dtype': 'int16'}
+    tmp_path = '{}.{}.tmp'.format(manifest_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, manifest_path)
+
+
+def load_fast(root, train=True):
+    """Open a split converted by convert_cifar100, returns (data, targets, classes) or None if absent
+
+    The images and the int16 labels are memory-mapped read-only, so every DataLoader worker and
+    every concurrent trial shares the same page-cache pages; __getitem__ widens each label to int.
+    """
+    split = 'train' if train else 'test'
+    folder = os.path.join(root, FAST_FOLDER)
+    manifest_path = os.path.join(folder, '{}_manifest.json'.format(split))
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    data = np.load(os.path.join(folder, '{}_data.npy'.format(split)), mmap_mode='r')
+    if list(data.shape) != manifest['shape']:
+        raise ValueError('{} does not match its manifest, delete it to convert again'.format(folder))
+    targets = np.load(os.path.join(folder, '{}_targets.npy'.format(split)), mmap_mode='r')
+    return data, targets, manifest['classes']
+
+
 class CIFAR100BackCompat(datasets.CIFAR100):
     """
     CIFAR100Instance+Sample Dataset
+    with shared=True the split is opened from the fast-start layout (see convert_cifar100),
+    converting it from the torchvision archive on first use
     """
+    def __init__(self, root, train=True, transform=None, target_transform=None, download=False, shared=False):
+        root = os.path.expanduser(root)
+        fast = load_fast(root, train) if shared else None
+        if fast is None:
+            super().__init__(root=root, train=train, download=download,
+                             transform=transform, target_transform=target_transform)
+            if not shared:
+                return
+            convert_cifar100(self)
+            fast = load_fast(root, train)
+        else:
+            # skip the integrity check and unpickling of the archive
+            datasets.VisionDataset.__init__(self, root, transform=transform, target_transform=target_transform)
+            self.train = train
+        self.data, self.targets, self.classes = fast
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+
+    def __getitem__(self, index):
+
+        img, target = self.data[index], int(self.targets[index])
+
+        # doing this so that it is consistent with all other datasets
+        # to return a PIL Image
+        img = Image.fromarray(img)
+
+        if self.transform is not None:
+            img = self.transform(img)
+
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+
+        return img, target
 
     @property
     def train_labels(self):
@@ -49,12 +140,13 @@ class CIFAR100BackCompat(datasets.CIFAR100):
     def test_data(self):
         return self.data
 
+
 class CIFAR100Instance(CIFAR100BackCompat):
     """CIFAR100Instance Dataset.
     """
     def __getitem__(self, index):
         
-        img, target = self.data[index], self.targets[index]
+        img, target = self.data[index], int(self.targets[index])
 
         # doing this so that it is consistent with all other datasets
         # to return a PIL Image
@@ -69,7 +161,152 @@ class CIFAR100Instance(CIFAR100BackCompat):
         return img, target, index
 
 
-def get_cifar100_dataloaders(batch_size=128, num_workers=8, is_instance=False):
+# RandomCrop(32, padding=4) + RandomHorizontalFlip has a finite set of views:
+# per-channel normalization of the CIFAR-100 images
+MEAN = (0.5071, 0.4867, 0.4408)
+STD = (0.2675, 0.2565, 0.2761)
+
+# a view id encodes (crop row offset, crop column offset, flip)
+CIFAR_PAD = 4
+NUM_OFFSETS = 2 * CIFAR_PAD + 1
+NUM_VIEWS = NUM_OFFSETS * NUM_OFFSETS * 2
+CENTER_VIEW = (CIFAR_PAD * NUM_OFFSETS + CIFAR_PAD) * 2
+
+
+def view_params(view):
+    """view id -> (dy, dx, flip)"""
+    return view // 2 // NUM_OFFSETS, view // 2 % NUM_OFFSETS, view % 2
+
+
+def apply_view(img, view):
+    """crop and flip an unpadded HxWxC uint8 image as described by a view id"""
+    dy, dx, flip = view_params(view)
+    H, W = img.shape[:2]
+    padded = np.pad(img, ((CIFAR_PAD, CIFAR_PAD), (CIFAR_PAD, CIFAR_PAD), (0, 0)))
+    out = padded[dy:dy + H, dx:dx + W]
+    if flip:
+        out = out[:, ::-1]
+    return np.ascontiguousarray(out)
+
+
+def draw_views(seed, epoch, index):
+    """Deterministic view ids for (seed, epoch, index), index may be an int or an array
+
+    A splitmix64 hash of the triple, so any view can be regenerated later without
+    storing pixels or RNG states.
+    """
+    with np.errstate(over='ignore'):
+        x = np.asarray(index, dtype=np.uint64)
+        x = x + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15) + np.uint64(epoch) * np.uint64(0xD1B54A32D192ED03)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    return (x % np.uint64(NUM_VIEWS)).astype(np.int64)
+
+
+class CIFAR100View(CIFAR100BackCompat):
+    """CIFAR100 Dataset that draws the crop/flip augmentation itself and returns its view id,
+    so that per-view teacher outputs can be looked up (see helper.teacher_cache).
+    The transform should only hold ToTensor/Normalize.
+
+    With a seed the view of a sample only depends on (seed, epoch, index): every run and every
+    student that calls set_epoch() with the same epoch sees the same augmented images.
+    """
+    def __init__(self, root, train=True, transform=None, target_transform=None, download=False, seed=None,
+                 shared=False):
+        super().__init__(root=root, train=train, download=download,
+                         transform=transform, target_transform=target_transform, shared=shared)
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __getitem__(self, index):
+
+        img, target = self.data[index], int(self.targets[index])
+
+        if not self.train:
+            view = CENTER_VIEW
+        elif self.seed is None:
+            view = np.random.randint(NUM_VIEWS)
+        else:
+            view = int(draw_views(self.seed, self.epoch, index))
+        img = Image.fromarray(apply_view(img, view))
+
+        if self.transform is not None:
+            img = self.transform(img)
+
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+
+        return img, target, index, view
+
+
+class CIFAR100TensorLoader(object):
+    """Batch-level CIFAR loader that augments on the uint8 array instead of per-sample PIL transforms
+
+    The images are padded once; every batch is then a single gather (crop offsets and flips
+    folded into the row/column indices) followed by one fused scale-and-shift normalization,
+    so no worker processes are needed.
+
+    Args:
+        dataset: a CIFAR100View, its train flag, seed and epoch select the views (its transform is unused)
+        return_index: also yield the dataset indices of the batch
+        return_view: also yield the view ids of the batch (implies return_index)
+        device: where the padded images live and batches are built
+    """
+    def __init__(self, dataset, batch_size, shuffle=False, return_index=False, return_view=False, device=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.return_index = return_index or return_view
+        self.return_view = return_view
+        pad = ((0, 0), (CIFAR_PAD, CIFAR_PAD), (CIFAR_PAD, CIFAR_PAD), (0, 0))
+        self.padded = torch.from_numpy(np.pad(dataset.data, pad)).to(device)
+        self.targets = torch.from_numpy(np.asarray(dataset.targets, dtype=np.int64)).to(device)
+        self.size = self.padded.shape[1] - 2 * CIFAR_PAD
+        mean = torch.tensor((0.5071, 0.4867, 0.4408), device=device).view(1, 3, 1, 1)
+        std = torch.tensor((0.2675, 0.2565, 0.2761), device=device).view(1, 3, 1, 1)
+        # (x / 255 - mean) / std == x * scale + shift
+        self.scale = 1. / (255. * std)
+        self.shift = -mean / std
+
+    def __len__(self):
+        return (len(self.targets) + self.batch_size - 1) // self.batch_size
+
+    def _views(self, index):
+        if not self.dataset.train:
+            return torch.full_like(index, CENTER_VIEW)
+        if self.dataset.seed is None:
+            return torch.randint(NUM_VIEWS, index.shape, device=index.device)
+        views = draw_views(self.dataset.seed, self.dataset.epoch, index.cpu().numpy())
+        return torch.from_numpy(views).to(index.device)
+
+    def __iter__(self):
+        n_data = len(self.targets)
+        device = self.padded.device
+        order = torch.randperm(n_data, device=device) if self.shuffle else torch.arange(n_data, device=device)
+        offsets = torch.arange(self.size, device=device)
+        for start in range(0, n_data, self.batch_size):
+            index = order[start:start + self.batch_size]
+            view = self._views(index)
+            dy, dx, flip = view_params(view)
+            rows = dy[:, None] + offsets
+            cols = dx[:, None] + torch.where(flip[:, None].bool(), self.size - 1 - offsets, offsets)
+            img = self.padded[index[:, None, None], rows[:, :, None], cols[:, None, :]]
+            input = torch.empty((len(index), 3, self.size, self.size), device=device)
+            torch.addcmul(self.shift, img.permute(0, 3, 1, 2), self.scale, out=input)
+            batch = [input, self.targets[index]]
+            if self.return_index:
+                batch.append(index)
+            if self.return_view:
+                batch.append(view)
+            yield batch
+
+
+def get_cifar100_dataloaders(batch_size=128, num_workers=8, is_instance=False, is_view=False, aug_seed=None,
+                             on_tensor=False, shared=False):
     """
     cifar 100
     """
@@ -86,26 +323,46 @@ def get_cifar100_dataloaders(batch_size=128, num_workers=8, is_instance=False):
         transforms.Normalize((0.5071, 0.4867, 0.4408), (0.2675, 0.2565, 0.2761)),
     ])
 
+    if on_tensor:
+        train_set = CIFAR100View(root=data_folder, download=True, train=True, seed=aug_seed, shared=shared)
+        test_set = CIFAR100View(root=data_folder, download=True, train=False, shared=shared)
+        train_loader = CIFAR100TensorLoader(train_set, batch_size, shuffle=True,
+                                            return_index=is_instance, return_view=is_view)
+        test_loader = CIFAR100TensorLoader(test_set, int(batch_size/2))
+        if is_instance:
+            return train_loader, test_loader, len(train_set)
+        return train_loader, test_loader
+
     if is_instance:
         train_set = CIFAR100Instance(root=data_folder,
                                      download=True,
                                      train=True,
-                                     transform=train_transform)
+                                     transform=train_transform,
+                                     shared=shared)
         n_data = len(train_set)
+    elif is_view:
+        train_set = CIFAR100View(root=data_folder,
+                                 download=True,
+                                 train=True,
+                                 transform=test_transform,
+                                 seed=aug_seed,
+                                 shared=shared)
     else:
-        train_set = datasets.CIFAR100(root=data_folder,
-                                      download=True,
-                                      train=True,
-                                      transform=train_transform)
+        train_set = CIFAR100BackCompat(root=data_folder,
+                                       download=True,
+                                       train=True,
+                                       transform=train_transform,
+                                       shared=shared)
     train_loader = DataLoader(train_set,
                               batch_size=batch_size,
                               shuffle=True,
                               num_workers=num_workers)
 
-    test_set = datasets.CIFAR100(root=data_folder,
-                                 download=True,
-                                 train=False,
-                                 transform=test_transform)
+    test_set = CIFAR100BackCompat(root=data_folder,
+                                  download=True,
+                                  train=False,
+                                  transform=test_transform,
+                                  shared=shared)
     test_loader = DataLoader(test_set,
                              batch_size=int(batch_size/2),
                              shuffle=False,
@@ -123,42 +380,51 @@ class CIFAR100InstanceSample(CIFAR100BackCompat):
     """
     def __init__(self, root, train=True,
                  transform=None, target_transform=None,
-                 download=False, k=4096, mode='exact', is_sample=True, percent=1.0):
+                 download=False, k=4096, mode='exact', is_sample=True, percent=1.0, shared=False):
         super().__init__(root=root, train=train, download=download,
-                         transform=transform, target_transform=target_transform)
+                         transform=transform, target_transform=target_transform, shared=shared)
         self.k = k
         self.mode = mode
         self.is_sample = is_sample
 
         num_classes = 100
-        num_samples = len(self.data)
-        label = self.targets
-       
-        self.cls_positive = [[] for i in range(num_classes)]
-        for i in range(num_samples):
-            self.cls_positive[label[i]].append(i)
-
-        self.cls_negative = [[] for i in range(num_classes)]
-        for i in range(num_classes):
-            for j in range(num_classes):
-                if j == i:
-                    continue
-                self.cls_negative[i].extend(self.cls_positive[j])
-
-        self.cls_positive = [np.asarray(self.cls_positive[i]) for i in range(num_classes)]
-        self.cls_negative = [np.asarray(self.cls_negative[i]) for i in range(num_classes)]
+        label = np.asarray(self.targets)
 
-        if 0 < percent < 1:
-            n = int(len(self.cls_negative[0]) * percent)
-            self.cls_negative = [np.random.permutation(self.cls_negative[i])[0:n]
-                                 for i in range(num_classes)]
+        # class-sorted sample indices: the positives of class c are
+        # cls_index[cls_offset[c]:cls_offset[c + 1]] and its negatives are the rest of cls_index
+        self.cls_index = np.argsort(label, kind='stable').astype(np.int32)
+        self.cls_offset = np.concatenate(([0], np.cumsum(np.bincount(label, minlength=num_classes))))
 
-        self.cls_positive = np.asarray(self.cls_positive)
-        self.cls_negative = np.asarray(self.cls_negative)
+        # with percent < 1 every class keeps a fixed random subset of its negatives instead
+        self.cls_negative = None
+        if 0 < percent < 1:
+            n = int((len(label) - self.cls_offset[1]) * percent)
+            self.cls_negative = np.stack([
+                self._negatives(np.full(n, c), np.random.permutation(len(label) - self._class_size(c))[:n])
+                for c in range(num_classes)])
+
+    def _class_size(self, target):
+        return self.cls_offset[target + 1] - self.cls_offset[target]
+
+    def _negatives(self, target, pos):
+        """map positions in [0, number of negatives of target) to the sample indices of those negatives"""
+        start = self.cls_offset[target]
+        pos = pos + (pos >= start) * self._class_size(target)
+        return self.cls_index[pos]
+
+    def _num_negatives(self, target):
+        if self.cls_negative is None:
+            return len(self.cls_index) - self._class_size(target)
+        return self.cls_negative.shape[1]
+
+    def _draw_negatives(self, target, pos):
+        if self.cls_negative is None:
+            return self._negatives(target, pos)
+        return self.cls_negative[target, pos]
 
     def __getitem__(self, index):
         
-        img, target = self.data[index], self.targets[index]
+        img, target = self.data[index], int(self.targets[index])
         
         # doing this so that it is consistent with all other datasets
         # to return a PIL Image
@@ -178,19 +444,48 @@ class CIFAR100InstanceSample(CIFAR100BackCompat):
             if self.mode == 'exact':
                 pos_idx = index
             elif self.mode == 'relax':
-                pos_idx = np.random.choice(self.cls_positive[target], 1)
-                pos_idx = pos_idx[0]
+                pos_idx = self.cls_index[self.cls_offset[target] + np.random.randint(self._class_size(target))]
             else:
                 raise NotImplementedError(self.mode)
-            replace = True if self.k > len(self.cls_negative[target]) else False
-            neg_idx = np.random.choice(self.cls_negative[target], self.k, replace=replace)
+            n_negative = self._num_negatives(target)
+            replace = True if self.k > n_negative else False
+            neg_idx = self._draw_negatives(target, np.random.choice(n_negative, self.k, replace=replace))
             sample_idx = np.hstack((np.asarray([pos_idx]), neg_idx))
             return img, target, index, sample_idx
 
+    def sample_contrast(self, index, target):
+        """Draw the contrastive indices of a whole batch at once
+
+        Same as the per-item sample_idx of __getitem__, except that the negatives are
+        drawn with replacement (as ContrastMemory does when no contrast_idx is given).
+
+        Args:
+            index: dataset indices of the batch, size [batch_size]
+            target: labels of the batch, size [batch_size]
+
+        Returns:
+            LongTensor [batch_size, k + 1], the positive first
+        """
+        index = np.asarray(index)
+        target = np.asarray(target)
+        if self.mode == 'exact':
+            pos_idx = index
+        elif self.mode == 'relax':
+            pos_idx = self.cls_index[self.cls_offset[target] + np.random.randint(self._class_size(target))]
+        else:
+            raise NotImplementedError(self.mode)
+        target = target[:, None]
+        pos = np.random.randint(self._num_negatives(target), size=(len(index), self.k))
+        neg_idx = self._draw_negatives(target, pos)
+        sample_idx = np.concatenate((pos_idx[:, None], neg_idx), axis=1)
+        return torch.from_numpy(sample_idx).long()
+
 def get_cifar100_dataloaders_sample(batch_size=128, num_workers=8, k=4096, mode='exact',
-                                    is_sample=True, percent=1.0):
+                                    is_sample=True, percent=1.0, batch_sample=True, shared=False):
     """
     cifar 100
+    with batch_sample the workers only return (img, target, index) and the training loop
+    draws the contrastive indices through train_loader.dataset.sample_contrast
     """
     data_folder = get_data_folder()
 
@@ -211,18 +506,20 @@ def get_cifar100_dataloaders_sample(batch_size=128, num_workers=8, k=4096, mode=
                                        transform=train_transform,
                                        k=k,
                                        mode=mode,
-                                       is_sample=is_sample,
-                                       percent=percent)
+                                       is_sample=is_sample and not batch_sample,
+                                       percent=percent,
+                                       shared=shared)
     n_data = len(train_set)
     train_loader = DataLoader(train_set,
                               batch_size=batch_size,
                               shuffle=True,
                               num_workers=num_workers)
 
-    test_set = datasets.CIFAR100(root=data_folder,
-                                 download=True,
-                                 train=False,
-                                 transform=test_transform)
+    test_set = CIFAR100BackCompat(root=data_folder,
+                                  download=True,
+                                  train=False,
+                                  transform=test_transform,
+                                  shared=shared)
     test_loader = DataLoader(test_set,
                              batch_size=int(batch_size/2),
                              shuffle=False,
@@ -1,17 +1,43 @@
 from __future__ import print_function
 
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
 
+class _SoftKL(torch.autograd.Function):
+    """T^2 * KL(p_t || softmax(y_s/T)) averaged over the batch, with its gradient formed in the same pass"""
+    @staticmethod
+    def forward(ctx, y_s, log_p_t, T):
+        bsz = y_s.shape[0]
+        log_p_s = F.log_softmax(y_s.float() / T, dim=1)
+        p_t = log_p_t.exp()
+        loss = (p_t * (log_p_t - log_p_s)).sum() * (T ** 2 / bsz)
+        # d loss / d y_s = T * (softmax(y_s/T) - p_t) / bsz
+        ctx.save_for_backward(log_p_s.exp_().sub_(p_t).mul_(T / bsz).to(y_s.dtype))
+        return loss
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        grad, = ctx.saved_tensors
+        return grad * grad_output, None, None
+
+
 class DistillKL(nn.Module):
-    """Distilling the Knowledge in a Neural Network"""
+    """Distilling the Knowledge in a Neural Network
+
+    forward(y_s, y_t) or forward(y_s, log_p_t=soft_targets(y_t)), the latter lets the loop
+    soften the teacher logits once per batch for every loss and student using them
+    """
     def __init__(self, T):
         super(DistillKL, self).__init__()
         self.T = T
 
-    def forward(self, y_s, y_t):
-        p_s = F.log_softmax(y_s/self.T, dim=1)
-        p_t = F.softmax(y_t/self.T, dim=1)
-        loss = nn.KLDivLoss(reduction='batchmean')(p_s, p_t) * (self.T**2)
-        return loss
+    def soft_targets(self, y_t):
+        """teacher log-probabilities at temperature T"""
+        return F.log_softmax(y_t.detach().float() / self.T, dim=1)
+
+    def forward(self, y_s, y_t=None, log_p_t=None):
+        if log_p_t is None:
+            log_p_t = self.soft_targets(y_t)
+        return _SoftKL.apply(y_s, log_p_t, self.T)
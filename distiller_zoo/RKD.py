@@ -3,57 +3,83 @@ from __future__ import print_function
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+from .relation import relation_cache, gram, sq_dist, zero_diagonal
 
 
 class RKDLoss(nn.Module):
     """Relational Knowledge Disitllation, CVPR2019"""
-    def __init__(self, w_d=25, w_a=50):
+    def __init__(self, w_d=25, w_a=50, angle_chunk=0):
         super(RKDLoss, self).__init__()
         self.w_d = w_d
         self.w_a = w_a
+        # anchors per chunk of the angle loss, 0 computes all BxBxB angles at once
+        self.angle_chunk = angle_chunk
 
     def forward(self, f_s, f_t):
         student = f_s.view(f_s.shape[0], -1)
         teacher = f_t.view(f_t.shape[0], -1)
 
+        # teacher relations are shared through relation_cache by every loss and student of the batch
+        with torch.no_grad():
+            t_gram = relation_cache(f_t, 'gram')
+            t_inv = relation_cache(f_t, 'inv_dist')
+            t_d = relation_cache(f_t, 'dist')
+        s_gram = gram(student)
+        s_sq_dist = sq_dist(s_gram)
+        s_inv = zero_diagonal(s_sq_dist.rsqrt())
+
         # RKD distance loss
         with torch.no_grad():
-            t_d = self.pdist(teacher, squared=False)
             mean_td = t_d[t_d > 0].mean()
             t_d = t_d / mean_td
 
-        d = self.pdist(student, squared=False)
+        d = zero_diagonal(s_sq_dist.sqrt())
         mean_d = d[d > 0].mean()
         d = d / mean_d
 
         loss_d = F.smooth_l1_loss(d, t_d)
 
         # RKD Angle loss
-        with torch.no_grad():
-            # From Bxdim -> 1xBxdim - Bx1xdim = BxBxdim
-            td = (teacher.unsqueeze(0) - teacher.unsqueeze(1))
-            norm_td = F.normalize(td, p=2, dim=2)
-            t_angle = torch.bmm(norm_td, norm_td.transpose(1, 2)).view(-1)
-
-        sd = (student.unsqueeze(0) - student.unsqueeze(1))
-        norm_sd = F.normalize(sd, p=2, dim=2)
-        s_angle = torch.bmm(norm_sd, norm_sd.transpose(1, 2)).view(-1)
-
-        loss_a = F.smooth_l1_loss(s_angle, t_angle)
+        loss_a = self.angle_loss(s_gram, s_inv, t_gram, t_inv)
 
         loss = self.w_d * loss_d + self.w_a * loss_a
 
         return loss
 
-    @staticmethod
-    def pdist(e, squared=False, eps=1e-12):
-        e_square = e.pow(2).sum(dim=1)
-        prod = e @ e.t()
-        res = (e_square.unsqueeze(1) + e_square.unsqueeze(0) - 2 * prod).clamp(min=eps)
+    def angle_loss(self, s_gram, s_inv, t_gram, t_inv):
+        """smooth-l1 between the student and teacher angles of all (anchor, j, k) triplets
+
+        The cosine between e_j - e_i and e_k - e_i is read off the Gram matrix and the pairwise
+        distances, so the BxBxdim differences are never formed. With angle_chunk the anchors are
+        processed (and recomputed in backward) in chunks, bounding memory to chunk x B x B.
+
+        Args:
+            s_gram, t_gram: BxB Gram matrices of the student and teacher features
+            s_inv, t_inv: BxB inverse pairwise distances with a zero diagonal
+        """
+        bsz = s_gram.shape[0]
 
-        if not squared:
-            res = res.sqrt()
+        chunk = self.angle_chunk if 0 < self.angle_chunk < bsz else bsz
+        loss = 0
+        for start in range(0, bsz, chunk):
+            end = min(start + chunk, bsz)
+            with torch.no_grad():
+                t_angle = self.angle(t_gram, t_inv, start, end)
+            if chunk < bsz and torch.is_grad_enabled():
+                loss = loss + checkpoint(self._angle_chunk_loss, s_gram, s_inv, t_angle, start, end,
+                                         use_reentrant=False)
+            else:
+                loss = loss + self._angle_chunk_loss(s_gram, s_inv, t_angle, start, end)
+        return loss / bsz ** 3
 
-        res = res.clone()
-        res[range(len(e)), range(len(e))] = 0
-        return res
+    def _angle_chunk_loss(self, gram, inv, t_angle, start, end):
+        return F.smooth_l1_loss(self.angle(gram, inv, start, end), t_angle, reduction='sum')
+
+    @staticmethod
+    def angle(gram, inv, start, end):
+        """cos of the angle (e_j - e_i, e_k - e_i) for anchors i in [start, end), (end-start) x B x B"""
+        g = gram[start:end]
+        cos = gram.unsqueeze(0) - g.unsqueeze(1) - g.unsqueeze(2) + gram.diagonal()[start:end, None, None]
+        return cos * inv[start:end].unsqueeze(2) * inv[start:end].unsqueeze(1)
@@ -9,15 +9,14 @@ class SemCKDLoss(nn.Module):
     """Cross-Layer Distillation with Semantic Calibration, AAAI2021"""
     def __init__(self):
         super(SemCKDLoss, self).__init__()
-        self.crit = nn.MSELoss(reduction='none')
-        
+
     def forward(self, s_value, f_target, weight):
         bsz, num_stu, num_tea = weight.shape
-        ind_loss = torch.zeros(bsz, num_stu, num_tea).cuda()
-
-        for i in range(num_stu):
-            for j in range(num_tea):
-                ind_loss[:, i, j] = self.crit(s_value[i][j], f_target[i][j]).reshape(bsz,-1).mean(-1)
+        # per-sample MSE of every (student layer, teacher layer) pair, stacked into one
+        # bsz x num_stu x num_tea tensor on the device of the features
+        ind_loss = torch.stack([F.mse_loss(s, t, reduction='none').reshape(bsz, -1).mean(-1)
+                                for s_row, t_row in zip(s_value, f_target)
+                                for s, t in zip(s_row, t_row)], 1).reshape(bsz, num_stu, num_tea)
 
         loss = (weight * ind_loss).sum()/(1.0*bsz*num_stu)
-        return loss
\ No newline at end of file
+        return loss
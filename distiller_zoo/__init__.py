@@ -2,4 +2,6 @@ from .KD import DistillKL
 
 from .SemCKD import SemCKDLoss
 
-from .RKD import RKDLoss
\ No newline at end of file
+from .RKD import RKDLoss
+
+from .relation import RelationCache, relation_cache
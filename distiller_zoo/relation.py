@@ -0,0 +1,73 @@
+from __future__ import print_function
+
+import torch
+
+
+def gram(x):
+    """BxB inner products of the flattened rows of x"""
+    x = x.reshape(x.shape[0], -1)
+    return x @ x.t()
+
+
+def sq_dist(g, eps=1e-12):
+    """BxB squared euclidean distances from a Gram matrix, clamped at eps (also on the diagonal)"""
+    e_square = g.diagonal()
+    return (e_square.unsqueeze(1) + e_square.unsqueeze(0) - 2 * g).clamp(min=eps)
+
+
+def zero_diagonal(x):
+    """copy of the square matrix x with its diagonal set to 0, no gradient flows to the diagonal"""
+    eye = torch.eye(len(x), dtype=torch.bool, device=x.device)
+    return x.masked_fill(eye, 0)
+
+
+class RelationCache(object):
+    """Per-batch store of the BxB relations of teacher-side tensors
+
+    Entries are keyed by (tensor identity, version, layer, metric), so the relations of a
+    teacher feature are computed once per batch however many losses or students consume
+    them. Tensors that require grad (student features) are never cached, their relations
+    are simply computed. The training loops call clear() once per batch.
+
+    metrics:
+        gram: BxB inner products of the flattened rows
+        clamped_sq_dist: squared pairwise distances clamped at 1e-12
+        sq_dist: squared pairwise distances (diagonal 0)
+        dist: pairwise distances (diagonal 0)
+        inv_dist: inverse pairwise distances (diagonal 0)
+    """
+    def __init__(self):
+        self._store = {}
+
+    def clear(self):
+        self._store.clear()
+
+    def __call__(self, x, metric, layer=None):
+        if x.requires_grad and torch.is_grad_enabled():
+            return self._compute(x, metric, layer)
+        key = (id(x), x._version, layer, metric)
+        entry = self._store.get(key)
+        # the stored reference keeps x alive, so its id cannot be reused by another tensor
+        if entry is None or entry[0] is not x:
+            entry = (x, self._compute(x, metric, layer))
+            self._store[key] = entry
+        return entry[1]
+
+    def _compute(self, x, metric, layer):
+        # derived metrics reuse the cached gram, the diagonal is zeroed after sqrt/rsqrt so that no inf gradient reaches it
+        if metric == 'gram':
+            return gram(x)
+        elif metric == 'clamped_sq_dist':
+            return sq_dist(self(x, 'gram', layer))
+        elif metric == 'sq_dist':
+            return zero_diagonal(self(x, 'clamped_sq_dist', layer))
+        elif metric == 'dist':
+            return zero_diagonal(self(x, 'clamped_sq_dist', layer).sqrt())
+        elif metric == 'inv_dist':
+            return zero_diagonal(self(x, 'clamped_sq_dist', layer).rsqrt())
+        else:
+            raise NotImplementedError(metric)
+
+
+# shared by the distillers of distiller_zoo and models.util.SelfA
+relation_cache = RelationCache()
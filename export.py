@@ -0,0 +1,116 @@
+"""
+logits-only TorchScript (and ONNX) export of model_dict architectures or trained snapshots,
+with numerical parity against the eager model and eager vs exported CPU throughput
+"""
+
+from __future__ import print_function
+
+import os
+import argparse
+
+import torch
+
+from models import model_dict
+from helper.deploy import get_model_name, load_model, export_torchscript, export_onnx, onnx_runner, \
+    max_rel_err, throughput
+from helper.util import save_table
+
+
+def parse_option():
+
+    parser = argparse.ArgumentParser('argument for model export')
+
+    parser.add_argument('--model', type=str, nargs='+', default=None, choices=list(model_dict.keys()),
+                        help='architectures to export with random weights (default: every model_dict entry)')
+    parser.add_argument('--path', type=str, nargs='+', default=None,
+                        help='trained snapshot(s) to export instead, architecture parsed from the name')
+    parser.add_argument('--onnx', action='store_true', help='also export ONNX (needs onnx, parity needs onnxruntime)')
+    parser.add_argument('--input_size', type=int, default=32, help='height/width the graphs are traced at')
+    parser.add_argument('--n_cls', type=int, default=100, help='number of classes')
+    parser.add_argument('--batch_size', type=int, default=64, help='batch of the throughput measurement')
+    parser.add_argument('--n_iter', type=int, default=20, help='timed forwards per model and format')
+    parser.add_argument('--threads', type=int, default=None, help='torch CPU threads')
+    parser.add_argument('--tol', type=float, default=1e-4, help='largest accepted relative difference to eager')
+    parser.add_argument('--out_dir', type=str, default='./save/export', help='where the exported files go')
+    parser.add_argument('--report', type=str, default=None,
+                        help='results table, .json or .csv (default: <out_dir>/export_report.json)')
+
+    opt = parser.parse_args()
+
+    if opt.onnx:
+        try:
+            import onnx
+        except ImportError:
+            parser.error('--onnx needs the onnx package')
+    if opt.report is None:
+        opt.report = os.path.join(opt.out_dir, 'export_report.json')
+
+    return opt
+
+
+def main():
+    opt = parse_option()
+    if opt.threads is not None:
+        torch.set_num_threads(opt.threads)
+    if not os.path.isdir(opt.out_dir):
+        os.makedirs(opt.out_dir)
+
+    if opt.path is not None:
+        jobs = [(os.path.splitext(os.path.basename(p))[0], p) for p in opt.path]
+    else:
+        jobs = [(name, None) for name in (opt.model or model_dict.keys())]
+
+    torch.manual_seed(0)
+    size = (3, opt.input_size, opt.input_size)
+    example = torch.randn((2,) + size)
+    # another batch size than the traced one, so a batch dimension baked into the graph shows up
+    inputs = [torch.randn((1,) + size), torch.randn((5,) + size)]
+    bench = torch.randn((opt.batch_size,) + size)
+
+    rows = []
+    failed = []
+    for name, path in jobs:
+        if path is None:
+            model_name = name
+            model = model_dict[name](num_classes=opt.n_cls).eval()
+        else:
+            model_name = get_model_name(path)
+            model = load_model(path, model_name, opt.n_cls)
+        row = {'name': name, 'model': model_name, 'eager_img_per_s': throughput(model, bench, opt.n_iter)}
+
+        exported = []
+        ts_file = os.path.join(opt.out_dir, name + '.pt')
+        export_torchscript(model, example, ts_file)
+        exported.append(('torchscript', ts_file, torch.jit.load(ts_file)))
+        if opt.onnx:
+            onnx_file = os.path.join(opt.out_dir, name + '.onnx')
+            export_onnx(model, example, onnx_file)
+            try:
+                run = onnx_runner(onnx_file)
+            except ImportError:
+                run = None
+                print('{}: onnxruntime is not installed, no parity check of {}'.format(name, onnx_file))
+            exported.append(('onnx', onnx_file, run))
+
+        line = '{} [{}]: eager {:.1f} img/s'.format(name, model_name, row['eager_img_per_s'])
+        for fmt, file, run in exported:
+            row[fmt + '_file'] = file
+            if run is None:
+                continue
+            err = max_rel_err(model, run, inputs)
+            row[fmt + '_rel_err'] = err
+            row[fmt + '_img_per_s'] = throughput(run, bench, opt.n_iter)
+            line += ', {} {:.1f} img/s (rel err {:.1e})'.format(fmt, row[fmt + '_img_per_s'], err)
+            if err > opt.tol:
+                failed.append('{} ({})'.format(name, fmt))
+        rows.append(row)
+        print(line)
+
+    save_table(rows, opt.report)
+    print('==> report written to {}'.format(opt.report))
+    if failed:
+        raise SystemExit('exported graphs differ from eager beyond --tol: {}'.format(', '.join(failed)))
+
+
+if __name__ == '__main__':
+    main()
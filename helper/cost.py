@@ -0,0 +1,157 @@
+from __future__ import print_function
+
+import time
+
+import torch
+import torch.nn as nn
+from torch.multiprocessing.reductions import StorageWeakRef
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+from .recombine import parse_layer_group
+
+
+def default_groups(model):
+    """one layer group per top-level child that holds parameters, e.g. conv1, bn1, layer1, ..., fc"""
+    return [name for name, m in model.named_children() if any(True for _ in m.parameters())]
+
+
+def _group_of(name, groups):
+    for group in groups:
+        for prefix in parse_layer_group(group):
+            if name == prefix or name.startswith(prefix + '.'):
+                return group
+    return 'other'
+
+
+def group_costs(model, x, groups=None):
+    """Parameters and multiply-accumulates per image of every layer group
+
+    MACs count the Conv2d and Linear layers of one forward of `x` (BN, activations and pooling
+    are left out); a module called several times is counted on every call.
+
+    Args:
+        groups: layer-group specs as in helper.recombine ('conv1+bn1+layer1', ...), defaults to
+            default_groups(model); whatever they do not cover is reported as 'other'
+
+    Returns:
+        dict group -> {'params': int, 'macs': int}
+    """
+    groups = list(groups or default_groups(model))
+    costs = {g: {'params': 0, 'macs': 0} for g in groups + ['other']}
+    for name, p in model.named_parameters():
+        costs[_group_of(name, groups)]['params'] += p.numel()
+
+    def hook(m, inp, out):
+        if isinstance(m, nn.Conv2d):
+            k = m.in_channels // m.groups * m.kernel_size[0] * m.kernel_size[1]
+        else:
+            k = m.in_features
+        costs[group[m]]['macs'] += out.numel() // x.shape[0] * k
+
+    group = {}
+    handles = []
+    for name, m in model.named_modules():
+        if isinstance(m, (nn.Conv2d, nn.Linear)):
+            group[m] = _group_of(name, groups)
+            handles.append(m.register_forward_hook(hook))
+    training = model.training
+    try:
+        model.eval()
+        with torch.no_grad():
+            model(x)
+    finally:
+        model.train(training)
+        for h in handles:
+            h.remove()
+    if not costs['other']['params'] and not costs['other']['macs']:
+        del costs['other']
+    return costs
+
+
+class PeakMemory(TorchDispatchMode):
+    """Peak bytes of the tensors allocated while the mode is active (parameters and inputs that
+    exist beforehand are not counted), followed through the storages' lifetimes"""
+    def __init__(self):
+        super(PeakMemory, self).__init__()
+        self.live = {}
+        self.current = 0
+        self.peak = 0
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        out = func(*args, **(kwargs or {}))
+        for t in tree_flatten(out)[0]:
+            if isinstance(t, torch.Tensor) and t.device.type != 'meta':
+                storage = t.untyped_storage()
+                key = storage._cdata
+                if key not in self.live:
+                    self.live[key] = (StorageWeakRef(storage), storage.nbytes())
+                    self.current += storage.nbytes()
+        self.peak = max(self.peak, self.current)
+        for key, (ref, nbytes) in list(self.live.items()):
+            if ref.expired():
+                del self.live[key]
+                self.current -= nbytes
+        return out
+
+
+def _train_step(model, x):
+    model(x).sum().backward()
+
+
+def activation_memory(model, x):
+    """Peak tensor memory (bytes) of an inference forward and of a training forward + backward on x
+
+    Returns:
+        dict with 'infer_peak', 'train_peak' (activations, their gradients and the parameter
+        gradients) and 'train_saved' (activations kept for the backward, without the input and
+        the weights)
+    """
+    existing = set(t.untyped_storage()._cdata for t in list(model.parameters()) + list(model.buffers()) + [x])
+    training = model.training
+    model.zero_grad(set_to_none=True)
+    try:
+        model.eval()
+        with torch.no_grad(), PeakMemory() as infer:
+            model(x)
+
+        model.train()
+        saved = {}
+
+        def pack(t):
+            storage = t.untyped_storage()
+            if storage._cdata not in existing:
+                saved[storage._cdata] = storage.nbytes()
+            return t
+
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+            with PeakMemory() as train:
+                _train_step(model, x)
+    finally:
+        model.zero_grad(set_to_none=True)
+        model.train(training)
+    return {'infer_peak': infer.peak, 'train_peak': train.peak, 'train_saved': sum(saved.values())}
+
+
+def step_latency(model, x, n_iter=10, warmup=2):
+    """mean seconds of an inference forward (eval, no grad) and of a training forward + backward"""
+    training = model.training
+    result = {}
+    try:
+        model.eval()
+        with torch.no_grad():
+            for i in range(warmup + n_iter):
+                if i == warmup:
+                    start = time.time()
+                model(x)
+        result['forward'] = (time.time() - start) / n_iter
+        model.train()
+        for i in range(warmup + n_iter):
+            if i == warmup:
+                start = time.time()
+            _train_step(model, x)
+        result['forward_backward'] = (time.time() - start) / n_iter
+    finally:
+        model.zero_grad(set_to_none=True)
+        model.train(training)
+    return result
@@ -0,0 +1,97 @@
+from __future__ import print_function
+
+import io
+import os
+import time
+
+import torch
+import torch.nn as nn
+
+from models import model_dict
+
+
+def get_model_name(path):
+    """architecture of a snapshot such as GR_weight/KD_ShuffleV1_s2_best.pth or resnet8x4_best.pth"""
+    base = '_' + os.path.splitext(os.path.basename(path))[0] + '_'
+    names = [k for k in model_dict if '_' + k + '_' in base]
+    if not names:
+        raise ValueError('cannot tell the architecture of {}, pass --model'.format(path))
+    return max(names, key=len)
+
+
+def load_model(path, model_name=None, n_cls=100):
+    """model_dict network in eval mode with the weights of a snapshot saved by the training scripts"""
+    model = model_dict[model_name or get_model_name(path)](num_classes=n_cls)
+    model.load_state_dict(torch.load(path, map_location='cpu')['model'])
+    return model.eval()
+
+
+class LogitsOnly(nn.Module):
+    """forward(x) -> logits of a model_dict network, with is_feat/preact/features left at their
+    defaults so tracing sees a single tensor in and out"""
+    def __init__(self, model):
+        super(LogitsOnly, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x)
+
+
+def serialized_size(model):
+    """bytes of the saved state_dict (or of the saved TorchScript module)"""
+    buf = io.BytesIO()
+    if isinstance(model, torch.jit.ScriptModule):
+        torch.jit.save(model, buf)
+    else:
+        torch.save(model.state_dict(), buf)
+    return buf.tell()
+
+
+def export_torchscript(model, example, path=None):
+    """Logits-only TorchScript module of a model_dict network, loadable without the model code
+
+    The forward is traced at `example` (the batch size stays dynamic; control flow on the input
+    height, as in vgg, is fixed to the traced resolution) and frozen, which inlines the weights
+    and folds the conv-BN pairs.
+    """
+    with torch.no_grad():
+        module = torch.jit.freeze(torch.jit.trace(LogitsOnly(model).eval(), example))
+    if path is not None:
+        torch.jit.save(module, path)
+    return module
+
+
+def export_onnx(model, example, path, opset=17):
+    """logits-only ONNX graph (input 'input', output 'logits', dynamic batch), needs the onnx package"""
+    with torch.no_grad():
+        torch.onnx.export(LogitsOnly(model).eval(), (example,), path, dynamo=False, opset_version=opset,
+                          input_names=['input'], output_names=['logits'],
+                          dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}})
+
+
+def onnx_runner(path):
+    """callable tensor -> tensor running an exported graph in onnxruntime on the CPU"""
+    import onnxruntime
+    session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+    return lambda x: torch.from_numpy(session.run(None, {'input': x.numpy()})[0])
+
+
+def max_rel_err(ref, fn, inputs):
+    """largest |ref(x) - fn(x)| over the inputs, relative to max |ref(x)|"""
+    err = 0.
+    with torch.no_grad():
+        for x in inputs:
+            a = ref(x)
+            err = max(err, ((a - fn(x)).abs().max() / a.abs().max().clamp(min=1e-12)).item())
+    return err
+
+
+def throughput(fn, x, n_iter=20, warmup=3):
+    """images per second of fn on the batch x"""
+    with torch.no_grad():
+        for _ in range(warmup):
+            fn(x)
+        start = time.time()
+        for _ in range(n_iter):
+            fn(x)
+    return n_iter * x.shape[0] / (time.time() - start)
@@ -0,0 +1,164 @@
+from __future__ import print_function
+
+import copy
+import time
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from torch.overrides import TorchFunctionMode
+
+
+def _unwrap(model):
+    if isinstance(model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
+        return model.module
+    return model
+
+
+def _set_submodule(model, name, module):
+    parent_name, _, attr = name.rpartition('.')
+    setattr(model.get_submodule(parent_name), attr, module)
+
+
+class _CountUses(TorchFunctionMode):
+    """counts, per tensor id, the torch calls that take the tensor and produce a tensor (size/shape queries are not uses)"""
+    def __init__(self):
+        super(_CountUses, self).__init__()
+        self.uses = {}
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        out = func(*args, **(kwargs or {}))
+        if isinstance(out, (torch.Tensor, tuple, list)):
+            for a in list(args) + list((kwargs or {}).values()):
+                for t in (a if isinstance(a, (tuple, list)) else (a,)):
+                    if isinstance(t, torch.Tensor):
+                        self.uses[id(t)] = self.uses.get(id(t), 0) + 1
+        return out
+
+
+def find_conv_bn(model, example):
+    """Run `example` through `model` and return the (conv name, bn name) pairs where the
+    BatchNorm2d is the only consumer of the output of the Conv2d, on every call of both modules
+
+    Conv outputs that are returned as is_feat features (e.g. the stem of wrn) count as used.
+    """
+    names = {m: n for n, m in model.named_modules()}
+    counter = _CountUses()
+    outputs = {}
+    feeds = {}
+    calls = {}
+
+    def conv_hook(m, inp, out):
+        calls[m] = calls.get(m, 0) + 1
+        # the reference keeps `out` alive, so its id is not reused during the forward
+        outputs[id(out)] = (out, m)
+        counter.uses[id(out)] = 0
+
+    def bn_hook(m, inp, out):
+        calls[m] = calls.get(m, 0) + 1
+        entry = outputs.get(id(inp[0]))
+        src = entry if entry is not None and entry[0] is inp[0] else (None, None)
+        feeds.setdefault(m, []).append(src)
+
+    handles = []
+    for m in model.modules():
+        if type(m) is nn.Conv2d:
+            handles.append(m.register_forward_hook(conv_hook))
+        elif type(m) is nn.BatchNorm2d and m.track_running_stats:
+            handles.append(m.register_forward_hook(bn_hook))
+    try:
+        with torch.no_grad(), counter:
+            feats, logit = model(example, is_feat=True)
+    finally:
+        for h in handles:
+            h.remove()
+
+    for f in feats:
+        if id(f) in counter.uses:
+            counter.uses[id(f)] += 1
+
+    pairs = []
+    used = set()
+    for bn, srcs in feeds.items():
+        conv = srcs[0][1]
+        if conv is None or conv in used or calls[conv] != calls[bn]:
+            continue
+        if any(c is not conv or counter.uses[id(out)] != 1 for out, c in srcs):
+            continue
+        used.add(conv)
+        pairs.append((names[conv], names[bn]))
+    return pairs
+
+
+def _drop_noops(module):
+    """replace empty nn.Sequential (no-op shortcuts) by nn.Identity and remove nn.Identity from sequences"""
+    for name, child in list(module.named_children()):
+        _drop_noops(child)
+        if isinstance(child, nn.Sequential):
+            kept = [m for m in child if not isinstance(m, nn.Identity)]
+            if not kept:
+                setattr(module, name, nn.Identity())
+            elif len(kept) < len(child):
+                setattr(module, name, nn.Sequential(*kept))
+
+
+def _max_rel_err(a, b):
+    if isinstance(a, (list, tuple)):
+        return max([_max_rel_err(x, y) for x, y in zip(a, b)] or [0.])
+    return ((a - b).abs().max() / a.abs().max().clamp(min=1)).item()
+
+
+def inference_fuse(model, example=None, tol=1e-4):
+    """Inference copy of a model_dict network with every conv->BN pair folded into the conv
+
+    The pairs are found by tracing one forward of `example`, so any module layout is handled;
+    a BatchNorm fed by anything else (e.g. the pre-activation BNs of wrn) is kept. Empty
+    shortcut sequences and the folded BNs are removed. The copy is in eval mode and meant for
+    inference only: its BN statistics are gone and helpers such as get_bn_before_relu() no
+    longer apply. The outputs of both forwards (logits and is_feat features) are compared on
+    `example` and a RuntimeError is raised if they differ by more than `tol` (relative).
+
+    Args:
+        model: the model (or its DataParallel/DistributedDataParallel wrapper), left untouched
+        example: input batch used to trace the model, defaults to 2 random CIFAR images on the
+            device of the model
+    """
+    model = _unwrap(model)
+    fused = copy.deepcopy(model).eval()
+    if example is None:
+        device = next(model.parameters()).device
+        example = torch.randn(2, 3, 32, 32, device=device)
+
+    with torch.no_grad():
+        for conv_name, bn_name in find_conv_bn(fused, example):
+            conv = fused.get_submodule(conv_name)
+            bn = fused.get_submodule(bn_name)
+            _set_submodule(fused, conv_name, fuse_conv_bn_eval(conv, bn))
+            _set_submodule(fused, bn_name, nn.Identity())
+        _drop_noops(fused)
+
+        training = model.training
+        model.eval()
+        try:
+            err = _max_rel_err(model(example, is_feat=True), fused(example, is_feat=True))
+        finally:
+            model.train(training)
+    if err > tol:
+        raise RuntimeError('fused {} differs from the original by {:.2e}'.format(type(model).__name__, err))
+    return fused
+
+
+def measure_latency(model, x, n_iter=50, warmup=5):
+    """mean seconds per forward of `x` through `model` (eval mode, no grad)"""
+    model.eval()
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(x)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        start = time.time()
+        for _ in range(n_iter):
+            model(x)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+    return (time.time() - start) / n_iter
@@ -5,6 +5,12 @@ import time
 import torch
 
 from .util import AverageMeter, accuracy, reduce_tensor
+from .teacher_cache import CACHED_FEATS
+from .fuse import inference_fuse
+from distiller_zoo.relation import relation_cache
+
+# teacher features (indices into feat_t) consumed by each distiller
+TEACHER_FEATS = dict(CACHED_FEATS, crd=[-1])
 
 def train_vanilla(epoch, train_loader, model, criterion, optimizer, opt):
     """vanilla training  普通的训练"""
@@ -65,6 +71,48 @@ def train_vanilla(epoch, train_loader, model, criterion, optimizer, opt):
             
     return top1.avg, top5.avg, losses.avg
 
+def teacher_features(opt):
+    """teacher outputs consumed by opt.distill as a forward(features=...) selector, None for all of them"""
+    if opt.distill in TEACHER_FEATS:
+        return TEACHER_FEATS[opt.distill] + ['logit']
+    return None
+
+def distill_loss(feat_s, logit_s, feat_t, logit_t, target, module_list, criterion_list, opt,
+                 index=None, contrast_idx=None, log_p_t=None):
+    """Total distillation loss of one student given (already detached) teacher outputs
+
+    log_p_t: teacher soft targets from criterion_list[1].soft_targets(logit_t), computed once per batch
+    """
+    criterion_cls = criterion_list[0]
+    criterion_div = criterion_list[1]
+    criterion_kd = criterion_list[2]
+
+    # cls + kl div
+    loss_cls = criterion_cls(logit_s, target)
+    loss_div = criterion_div(logit_s, logit_t, log_p_t)
+    
+    # other kd beyond KL divergence
+    if opt.distill == 'kd':
+        loss_kd = 0
+    elif opt.distill == 'semckd':
+        s_value, f_target, weight = module_list[1](feat_s[1:-1], feat_t[1:-1])
+        loss_kd = criterion_kd(s_value, f_target, weight)                                              
+    elif opt.distill == 'rkd':
+        f_s = feat_s[-1]
+        f_t = feat_t[-1]
+        loss_kd = criterion_kd(f_s, f_t)
+    elif opt.distill == 'crd':
+        f_s = feat_s[-1]
+        f_t = feat_t[-1]
+        loss_kd = criterion_kd(f_s, f_t, index, contrast_idx)
+    else:
+        raise NotImplementedError(opt.distill)
+
+
+    ###  总的损失函数
+    loss = opt.gamma * loss_cls + opt.alpha * loss_div + opt.beta * loss_kd
+    return loss
+
 def train_distill(epoch, train_loader, module_list, criterion_list, optimizer, opt):
     """One epoch distillation  蒸馏训练"""
     # set modules as train()
@@ -78,10 +126,6 @@ def train_distill(epoch, train_loader, module_list, criterion_list, optimizer, o
     elif opt.distill == 'factor':
         module_list[2].eval()
 
-    criterion_cls = criterion_list[0]
-    criterion_div = criterion_list[1]
-    criterion_kd = criterion_list[2]
-
     model_s = module_list[0]
     model_t = module_list[-1]
 
@@ -97,8 +141,15 @@ def train_distill(epoch, train_loader, module_list, criterion_list, optimizer, o
     for idx, data in enumerate(train_loader):
         data_time.update(time.time() - end)
 
+        index, contrast_idx = None, None
         if opt.dali is None:
-            input, target = data
+            if opt.distill == 'crd':
+                input, target, index = data
+                contrast_idx = train_loader.dataset.sample_contrast(index, target)
+            elif not opt.is_view:
+                input, target = data
+            else:
+                input, target, index, view = data
             if opt.distill == 'semckd' and input.shape[0] < opt.batch_size:
                 continue
         else:
@@ -108,33 +159,25 @@ def train_distill(epoch, train_loader, module_list, criterion_list, optimizer, o
             input = input.cuda(opt.gpu if opt.multiprocessing_distributed else 0, non_blocking=True)
         if torch.cuda.is_available():
             target = target.cuda(opt.gpu if opt.multiprocessing_distributed else 0, non_blocking=True)
+            if opt.distill == 'crd':
+                index = index.cuda(opt.gpu if opt.multiprocessing_distributed else 0, non_blocking=True)
+                contrast_idx = contrast_idx.cuda(opt.gpu if opt.multiprocessing_distributed else 0, non_blocking=True)
 
         # ===================forward=====================
         feat_s, logit_s = model_s(input, is_feat=True)
+        # teacher relations cached for the previous batch are stale
+        relation_cache.clear()
         with torch.no_grad():
-            feat_t, logit_t = model_t(input, is_feat=True)
-            feat_t = [f.detach() for f in feat_t]
-
-        # cls + kl div
-        loss_cls = criterion_cls(logit_s, target)
-        loss_div = criterion_div(logit_s, logit_t)
-        
-        # other kd beyond KL divergence
-        if opt.distill == 'kd':
-            loss_kd = 0
-        elif opt.distill == 'semckd':
-            s_value, f_target, weight = module_list[1](feat_s[1:-1], feat_t[1:-1])
-            loss_kd = criterion_kd(s_value, f_target, weight)                                              
-        elif opt.distill == 'rkd':
-            f_s = feat_s[-1]
-            f_t = feat_t[-1]
-            loss_kd = criterion_kd(f_s, f_t)
-        else:
-            raise NotImplementedError(opt.distill)
-
+            if opt.teacher_cache is None:
+                feat_t, logit_t = model_t(input, is_feat=True, features=teacher_features(opt))
+            else:
+                # model_t is a helper.teacher_cache.TeacherCache
+                feat_t, logit_t = model_t(index, view, is_feat=True)
+            feat_t = [f if f is None else f.detach() for f in feat_t]
+            log_p_t = criterion_list[1].soft_targets(logit_t)
 
-        ###  总的损失函数
-        loss = opt.gamma * loss_cls + opt.alpha * loss_div + opt.beta * loss_kd
+        loss = distill_loss(feat_s, logit_s, feat_t, logit_t, target, module_list, criterion_list, opt,
+                            index, contrast_idx, log_p_t)
         losses.update(loss.item(), input.size(0))
 
         metrics = accuracy(logit_s, target, topk=(1, 5))
@@ -164,6 +207,192 @@ def train_distill(epoch, train_loader, module_list, criterion_list, optimizer, o
     return top1.avg, top5.avg, losses.avg, data_time.avg
 
 
+def train_distill_population(epoch, train_loader, module_lists, criterion_list, optimizers, opt):
+    """One epoch distillation of several students in lock-step
+    every batch is loaded once and the teacher runs once per batch, its outputs are shared by all students
+    """
+    for module_list in module_lists:
+        for module in module_list:
+            module.train()
+        module_list[-1].eval()
+
+        if opt.distill == 'abound':
+            module_list[1].eval()
+        elif opt.distill == 'factor':
+            module_list[2].eval()
+
+    model_t = module_lists[0][-1]
+
+    batch_time = AverageMeter()
+    data_time = AverageMeter()
+    losses = [AverageMeter() for _ in module_lists]
+    top1 = [AverageMeter() for _ in module_lists]
+    top5 = [AverageMeter() for _ in module_lists]
+
+    n_batch = len(train_loader) if opt.dali is None else (train_loader._size + opt.batch_size - 1) // opt.batch_size
+
+    end = time.time()
+    for idx, data in enumerate(train_loader):
+        data_time.update(time.time() - end)
+
+        index, contrast_idx = None, None
+        if opt.dali is None:
+            if opt.distill == 'crd':
+                input, target, index = data
+                contrast_idx = train_loader.dataset.sample_contrast(index, target)
+            elif not opt.is_view:
+                input, target = data
+            else:
+                input, target, index, view = data
+            if opt.distill == 'semckd' and input.shape[0] < opt.batch_size:
+                continue
+        else:
+            input, target = data[0]['data'], data[0]['label'].squeeze().long()
+
+        if opt.gpu is not None:
+            input = input.cuda(opt.gpu if opt.multiprocessing_distributed else 0, non_blocking=True)
+        if torch.cuda.is_available():
+            target = target.cuda(opt.gpu if opt.multiprocessing_distributed else 0, non_blocking=True)
+            if opt.distill == 'crd':
+                index = index.cuda(opt.gpu if opt.multiprocessing_distributed else 0, non_blocking=True)
+                contrast_idx = contrast_idx.cuda(opt.gpu if opt.multiprocessing_distributed else 0, non_blocking=True)
+
+        # ===================teacher forward=====================
+        # teacher relations cached for the previous batch are stale
+        relation_cache.clear()
+        with torch.no_grad():
+            if opt.teacher_cache is None:
+                feat_t, logit_t = model_t(input, is_feat=True, features=teacher_features(opt))
+            else:
+                # model_t is a helper.teacher_cache.TeacherCache
+                feat_t, logit_t = model_t(index, view, is_feat=True)
+            feat_t = [f if f is None else f.detach() for f in feat_t]
+            log_p_t = criterion_list[1].soft_targets(logit_t)
+
+        for i, (module_list, optimizer) in enumerate(zip(module_lists, optimizers)):
+            # ===================forward=====================
+            feat_s, logit_s = module_list[0](input, is_feat=True)
+            loss = distill_loss(feat_s, logit_s, feat_t, logit_t, target, module_list, criterion_list, opt,
+                                index, contrast_idx, log_p_t)
+            losses[i].update(loss.item(), input.size(0))
+
+            metrics = accuracy(logit_s, target, topk=(1, 5))
+            top1[i].update(metrics[0].item(), input.size(0))
+            top5[i].update(metrics[1].item(), input.size(0))
+
+            # ===================backward=====================
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+        batch_time.update(time.time() - end)
+        end = time.time()
+
+        # print info
+        if idx % opt.print_freq == 0:
+            for i in range(len(module_lists)):
+                print('Epoch: [{0}][{1}/{2}]\t'
+                      'GPU {3}\t'
+                      'Student {4}\t'
+                      'Time {batch_time.val:.3f} ({batch_time.avg:.3f})\t'
+                      'Data {data_time.val:.3f} ({data_time.avg:.3f})\t'
+                      'Loss {loss.avg:.4f}\t'
+                      'Acc@1 {top1.avg:.3f}\t'
+                      'Acc@5 {top5.avg:.3f}'.format(
+                    epoch, idx, n_batch, opt.gpu, i + 1, loss=losses[i], top1=top1[i], top5=top5[i],
+                    batch_time=batch_time, data_time=data_time))
+            sys.stdout.flush()
+
+    return [(top1[i].avg, top5[i].avg, losses[i].avg, data_time.avg) for i in range(len(module_lists))]
+
+
+def train_distill_vmap(epoch, train_loader, population, model_t, criterion_list, optimizer, opt):
+    """One epoch distillation of a helper.population.StudentPopulation
+    all students run in a single vmap-batched forward/backward on the shared batch and teacher outputs
+    """
+    if opt.distill not in ['kd', 'rkd']:
+        # semckd/crd carry trainable per-student heads that are not stacked into the population
+        raise NotImplementedError(opt.distill)
+
+    population.train()
+    model_t.eval()
+
+    n_pop = len(population)
+    batch_time = AverageMeter()
+    data_time = AverageMeter()
+    losses = [AverageMeter() for _ in range(n_pop)]
+    top1 = [AverageMeter() for _ in range(n_pop)]
+    top5 = [AverageMeter() for _ in range(n_pop)]
+
+    n_batch = len(train_loader) if opt.dali is None else (train_loader._size + opt.batch_size - 1) // opt.batch_size
+
+    end = time.time()
+    for idx, data in enumerate(train_loader):
+        data_time.update(time.time() - end)
+
+        if opt.dali is None:
+            if not opt.is_view:
+                input, target = data
+            else:
+                input, target, index, view = data
+        else:
+            input, target = data[0]['data'], data[0]['label'].squeeze().long()
+
+        if opt.gpu is not None:
+            input = input.cuda(opt.gpu if opt.multiprocessing_distributed else 0, non_blocking=True)
+        if torch.cuda.is_available():
+            target = target.cuda(opt.gpu if opt.multiprocessing_distributed else 0, non_blocking=True)
+
+        # ===================forward=====================
+        # teacher relations cached for the previous batch are stale
+        relation_cache.clear()
+        with torch.no_grad():
+            if opt.teacher_cache is None:
+                feat_t, logit_t = model_t(input, is_feat=True, features=teacher_features(opt))
+            else:
+                # model_t is a helper.teacher_cache.TeacherCache
+                feat_t, logit_t = model_t(index, view, is_feat=True)
+            feat_t = [f if f is None else f.detach() for f in feat_t]
+            log_p_t = criterion_list[1].soft_targets(logit_t)
+        feat_s, logit_s = population(input, is_feat=True)
+
+        # members share no parameters, so the gradient of the sum is the per-member gradient
+        loss = 0
+        for i in range(n_pop):
+            loss_i = distill_loss([f[i] for f in feat_s], logit_s[i], feat_t, logit_t, target, None, criterion_list, opt,
+                                  log_p_t=log_p_t)
+            losses[i].update(loss_i.item(), input.size(0))
+            metrics = accuracy(logit_s[i], target, topk=(1, 5))
+            top1[i].update(metrics[0].item(), input.size(0))
+            top5[i].update(metrics[1].item(), input.size(0))
+            loss = loss + loss_i
+
+        # ===================backward=====================
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+        batch_time.update(time.time() - end)
+        end = time.time()
+
+        # print info
+        if idx % opt.print_freq == 0:
+            for i in range(n_pop):
+                print('Epoch: [{0}][{1}/{2}]\t'
+                      'GPU {3}\t'
+                      'Student {4}\t'
+                      'Time {batch_time.val:.3f} ({batch_time.avg:.3f})\t'
+                      'Data {data_time.val:.3f} ({data_time.avg:.3f})\t'
+                      'Loss {loss.avg:.4f}\t'
+                      'Acc@1 {top1.avg:.3f}\t'
+                      'Acc@5 {top5.avg:.3f}'.format(
+                    epoch, idx, n_batch, opt.gpu, i + 1, loss=losses[i], top1=top1[i], top5=top5[i],
+                    batch_time=batch_time, data_time=data_time))
+            sys.stdout.flush()
+
+    return [(top1[i].avg, top5[i].avg, losses[i].avg, data_time.avg) for i in range(n_pop)]
+
+
 def validate(val_loader, model, criterion, opt):
     """validation"""
     
@@ -174,6 +403,7 @@ def validate(val_loader, model, criterion, opt):
 
     # switch to evaluate mode
     model.eval()
+    fuse = opt.fuse_eval
 
     n_batch = len(val_loader) if opt.dali is None else (val_loader._size + opt.batch_size - 1) // opt.batch_size
 
@@ -190,6 +420,11 @@ def validate(val_loader, model, criterion, opt):
             if torch.cuda.is_available():
                 target = target.cuda(opt.gpu if opt.multiprocessing_distributed else 0, non_blocking=True)
 
+            if fuse:
+                # evaluate a copy with the conv-BN pairs folded, traced on the first batch
+                model = inference_fuse(model, input[:2])
+                fuse = False
+
             # compute output
             output = model(input)
             loss = criterion(output, target)
@@ -0,0 +1,79 @@
+from __future__ import print_function
+
+import copy
+
+import torch
+from torch.func import stack_module_state, functional_call, vmap
+
+from .recombine import layer_group_tensors
+
+
+class StudentPopulation(object):
+    """N students of the same architecture stacked along a leading population dimension
+
+    All members run through a single functional forward/backward (functional_call + vmap),
+    and crossover between members is an index permutation along the population dimension.
+
+    Args:
+        models: list of nn.Module built from the same models.model_dict entry
+    """
+    def __init__(self, models):
+        self.size = len(models)
+        self.params, self.buffers = stack_module_state(models)
+        # stateless copy used as the functional template, it never holds real data
+        self.base = copy.deepcopy(models[0]).to('meta')
+
+    def __len__(self):
+        return self.size
+
+    def parameters(self):
+        return list(self.params.values())
+
+    def train(self):
+        self.base.train()
+
+    def eval(self):
+        self.base.eval()
+
+    def _forward(self, params, buffers, x, is_feat):
+        return functional_call(self.base, (params, buffers), (x,), {'is_feat': is_feat})
+
+    def __call__(self, x, is_feat=False):
+        """Forward the same input through every member
+
+        Returns:
+            logits of shape [N, B, n_cls], plus the list of [N, B, ...] features if is_feat
+        """
+        forward = vmap(self._forward, in_dims=(0, 0, None, None), randomness='different')
+        return forward(self.params, self.buffers, x, is_feat)
+
+    def crossover(self, spec, perm, suffixes=None):
+        """Member i receives the layer group `spec` of member perm[i]
+
+        Args:
+            spec: layer-group spec, see helper.recombine.parse_layer_group
+            perm: permutation of range(N), e.g. [1, 0] swaps the group between two students
+            suffixes: if given, only exchange tensors whose name ends with one of these
+        """
+        perm = torch.as_tensor(perm, dtype=torch.long)
+        with torch.no_grad():
+            for name, _ in layer_group_tensors(self.base, spec, suffixes):
+                stacked = self.params[name] if name in self.params else self.buffers[name]
+                stacked.copy_(stacked[perm.to(stacked.device)])
+
+    def state_dict(self, i):
+        """state_dict of member i, loadable into the original architecture"""
+        state = {k: v[i].detach().clone() for k, v in self.params.items()}
+        state.update({k: v[i].clone() for k, v in self.buffers.items()})
+        return state
+
+    def to(self, *args, **kwargs):
+        with torch.no_grad():
+            for k, v in self.params.items():
+                self.params[k] = v.to(*args, **kwargs).detach().requires_grad_(v.requires_grad)
+            for k, v in self.buffers.items():
+                self.buffers[k] = v.to(*args, **kwargs)
+        return self
+
+    def cuda(self, device=None):
+        return self.to('cuda' if device is None else device)
@@ -0,0 +1,80 @@
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import torch
+from torch.ao.quantization import get_default_qconfig, quantize_jit
+
+from dataset.cifar100 import MEAN, STD
+from .deploy import LogitsOnly
+from .util import AverageMeter, accuracy
+
+
+def calibration_set(path, n, seed=0, data=None):
+    """n training images (uint8 NxHxWxC) drawn without replacement, cached as a .npy file
+
+    Every quantization run calibrates on the same images. `data` (e.g. CIFAR100.data) is
+    only needed when the cache at `path` is missing or holds another number of images.
+    """
+    if os.path.isfile(path):
+        subset = np.load(path)
+        if len(subset) == n:
+            return subset
+    if data is None:
+        raise ValueError('no calibration cache at {}, the training images are needed to build it'.format(path))
+    index = np.sort(np.random.RandomState(seed).choice(len(data), n, replace=False))
+    subset = np.ascontiguousarray(data[index])
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    np.save(path, subset)
+    return subset
+
+
+def normalize_images(images):
+    """uint8 NxHxWxC array -> normalized float NxCxHxW tensor, as the CIFAR-100 test transform"""
+    x = torch.from_numpy(np.asarray(images)).permute(0, 3, 1, 2).float().div_(255)
+    mean = torch.tensor(MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(STD).view(1, 3, 1, 1)
+    return (x - mean) / std
+
+
+def quantize_static(model, calib, batch_size=64, engine='onednn'):
+    """Post-training static int8 quantization of a model_dict network
+
+    The logits-only forward is traced to TorchScript and quantized in graph mode: the trace
+    resolves the is_feat/preact branches and the functional relu/add/cat/shuffle ops of
+    every architecture, conv-BN pairs are folded and conv(-BN)-relu patterns run as single
+    quantized::conv2d_relu ops. Activation ranges are observed on `calib` (uint8 images).
+    The quantized kernels of `engine` must also be selected (torch.backends.quantized.engine)
+    wherever the returned module runs.
+
+    Returns:
+        the int8 torch.jit.ScriptModule, taking normalized float images and returning fp32 logits
+    """
+    torch.backends.quantized.engine = engine
+    model = LogitsOnly(model).eval()
+    batches = [normalize_images(calib[i:i + batch_size]) for i in range(0, len(calib), batch_size)]
+    with torch.no_grad():
+        traced = torch.jit.trace(model, batches[0])
+
+    def calibrate(m, data):
+        with torch.no_grad():
+            for x in data:
+                m(x)
+
+    return quantize_jit(traced, {'': get_default_qconfig(engine)}, calibrate, [batches])
+
+
+def evaluate(model, loader):
+    """top-1/top-5 (helper.util.accuracy) of `model` on a loader of (input, target) batches, on the CPU"""
+    top1 = AverageMeter()
+    top5 = AverageMeter()
+    with torch.no_grad():
+        for input, target in loader:
+            output = model(input)
+            acc1, acc5 = accuracy(output, target, topk=(1, 5))
+            top1.update(acc1.item(), input.size(0))
+            top5.update(acc5.item(), input.size(0))
+    return top1.avg, top5.avg
@@ -0,0 +1,85 @@
+from __future__ import print_function
+
+import torch
+
+
+def parse_layer_group(spec):
+    """parse a layer-group spec such as 'conv1+bn1+layer1' into a tuple of module prefixes"""
+    if isinstance(spec, str):
+        spec = spec.split('+')
+    prefixes = tuple(p.strip() for p in spec if p.strip())
+    if not prefixes:
+        raise ValueError('empty layer group: {!r}'.format(spec))
+    return prefixes
+
+
+def _named_tensors(model, prefix):
+    """parameters and buffers of the submodule (or the single tensor) called `prefix`"""
+    try:
+        module = model.get_submodule(prefix)
+    except AttributeError:
+        module_name, _, tensor_name = prefix.rpartition('.')
+        try:
+            module = model.get_submodule(module_name)
+        except AttributeError:
+            module = None
+        tensor = None if module is None else getattr(module, tensor_name, None)
+        if not isinstance(tensor, torch.Tensor):
+            raise KeyError('{} has no module named {}'.format(type(model).__name__, prefix))
+        return [(prefix, tensor)]
+    named = list(module.named_parameters(prefix)) + list(module.named_buffers(prefix))
+    return named
+
+
+def layer_group_tensors(model, spec, suffixes=None):
+    """Collect the parameters and buffers of `model` that belong to a layer group
+
+    Args:
+        model: any nn.Module, e.g. an entry of models.model_dict
+        spec: '+'-joined module names (or a list of them), e.g. 'conv1+bn1+layer1' or 'blocks.0'
+        suffixes: if given, only keep tensors whose name ends with one of these, e.g. ('weight',)
+
+    Returns:
+        list of (name, tensor)
+    """
+    if suffixes is not None:
+        suffixes = tuple('.' + s for s in suffixes)
+    tensors = []
+    for prefix in parse_layer_group(spec):
+        for name, t in _named_tensors(model, prefix):
+            if suffixes is None or name.endswith(suffixes):
+                tensors.append((name, t))
+    return tensors
+
+
+def layer_group_pairs(model_a, model_b, spec, suffixes=None):
+    """Match the tensors of a layer group across two models of the same architecture
+
+    The pairs stay valid across swaps (see swap_tensor_pairs), so they can be
+    resolved once and reused for every exchange.
+    """
+    tensors_b = dict(layer_group_tensors(model_b, spec, suffixes))
+    pairs = []
+    for name, t_a in layer_group_tensors(model_a, spec, suffixes):
+        t_b = tensors_b[name]
+        if t_a.shape != t_b.shape:
+            raise ValueError('shape mismatch for {}: {} vs {}'.format(name, tuple(t_a.shape), tuple(t_b.shape)))
+        pairs.append((t_a, t_b))
+    return pairs
+
+
+def swap_tensor_pairs(pairs):
+    """Exchange the contents of every (t_a, t_b) pair in place
+
+    Only the underlying storages are exchanged, so no intermediate clone or copy
+    kernel is issued and the Parameter objects (and therefore the optimizer
+    states keyed on them) stay attached to their model.
+    """
+    with torch.no_grad():
+        for t_a, t_b in pairs:
+            t_a.data, t_b.data = t_b.data, t_a.data
+
+
+def swap_layer_group(model_a, model_b, spec, suffixes=None):
+    """Exchange a layer group between two models of the same architecture in place"""
+    swap_tensor_pairs(layer_group_pairs(model_a, model_b, spec, suffixes))
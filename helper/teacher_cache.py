@@ -0,0 +1,118 @@
+from __future__ import print_function
+
+import os
+import json
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from dataset.cifar100 import CIFAR_PAD, NUM_VIEWS, MEAN, STD, view_params
+
+# teacher features (indices into feat_t) consumed by each distiller that can read them from the cache;
+# crd is left out, its sample loader yields no view ids to look the cached outputs up by
+CACHED_FEATS = {
+    'kd': [],
+    'rkd': [-1],
+}
+
+
+def _view_batch(padded, view, mean, std):
+    """slice one augmentation view out of a padded NxHxWxC uint8 array and normalize it"""
+    dy, dx, flip = view_params(view)
+    H, W = padded.shape[1] - 2 * CIFAR_PAD, padded.shape[2] - 2 * CIFAR_PAD
+    x = torch.from_numpy(padded[:, dy:dy + H, dx:dx + W]).permute(0, 3, 1, 2).float().div_(255)
+    if flip:
+        x = x.flip(3)
+    return (x - mean) / std
+
+
+def precompute_teacher_cache(model_t, data, path, distill='kd', batch_size=256, dtype='float16', model_name=None):
+    """Run a frozen teacher over every augmentation view of every training image and store the outputs
+
+    Args:
+        model_t: the teacher, already on its device and in eval mode
+        data: NxHxWxC uint8 array of training images (e.g. CIFAR100.data)
+        path: directory of the cache, holds logits.npy, feat*.npy and manifest.json
+        distill: selects which is_feat features are stored, see CACHED_FEATS
+    """
+    if distill not in CACHED_FEATS:
+        raise NotImplementedError(distill)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    device = next(model_t.parameters()).device
+    mean = torch.tensor(MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(STD).view(1, 3, 1, 1)
+    padded = np.pad(data, ((0, 0), (CIFAR_PAD, CIFAR_PAD), (CIFAR_PAD, CIFAR_PAD), (0, 0)))
+    n_data = len(data)
+
+    logits = None
+    feats = None
+    with torch.no_grad():
+        for view in range(NUM_VIEWS):
+            for start in range(0, n_data, batch_size):
+                x = _view_batch(padded[start:start + batch_size], view, mean, std).to(device)
+                feat_t, logit_t = model_t(x, is_feat=True, features=CACHED_FEATS[distill] + ['logit'])
+                if logits is None:
+                    logits = np.lib.format.open_memmap(os.path.join(path, 'logits.npy'), mode='w+', dtype=dtype,
+                                                       shape=(n_data, NUM_VIEWS, logit_t.shape[1]))
+                    feats = [np.lib.format.open_memmap(os.path.join(path, 'feat{}.npy'.format(i)), mode='w+',
+                                                       dtype=dtype, shape=(n_data, NUM_VIEWS) + tuple(feat_t[j].shape[1:]))
+                             for i, j in enumerate(CACHED_FEATS[distill])]
+                end = start + x.shape[0]
+                logits[start:end, view] = logit_t.cpu().numpy()
+                for f, j in zip(feats, CACHED_FEATS[distill]):
+                    f[start:end, view] = feat_t[j].cpu().numpy()
+            print('==> cached view {}/{}'.format(view + 1, NUM_VIEWS))
+
+    logits.flush()
+    for f in feats:
+        f.flush()
+    manifest = {
+        'model_t': model_name,
+        'distill': distill,
+        'n_data': n_data,
+        'num_views': NUM_VIEWS,
+        'pad': CIFAR_PAD,
+        'dtype': dtype,
+        'feats': CACHED_FEATS[distill],
+    }
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+
+class TeacherCache(nn.Module):
+    """Stand-in for the teacher in module_list that reads precomputed outputs
+
+    forward(index, view) returns (feat_t, logit_t) for the samples and augmentation views of the
+    batch, with feat_t holding only the features listed in the manifest.
+    """
+    def __init__(self, path, distill=None):
+        super(TeacherCache, self).__init__()
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            self.manifest = json.load(f)
+        if self.manifest['num_views'] != NUM_VIEWS or self.manifest['pad'] != CIFAR_PAD:
+            raise ValueError('teacher cache {} was built for another augmentation'.format(path))
+        if distill is not None:
+            if distill not in CACHED_FEATS:
+                raise NotImplementedError(distill)
+            if len(CACHED_FEATS[distill]) > len(self.manifest['feats']):
+                raise ValueError('teacher cache {} has no features for --distill {}'.format(path, distill))
+        self.logits = np.load(os.path.join(path, 'logits.npy'), mmap_mode='r')
+        self.feats = [np.load(os.path.join(path, 'feat{}.npy'.format(i)), mmap_mode='r')
+                      for i in range(len(self.manifest['feats']))]
+        # follows .cuda()/.to() so lookups land on the training device
+        self.register_buffer('anchor', torch.zeros(0), persistent=False)
+
+    def _lookup(self, store, index, view):
+        out = torch.from_numpy(store[index, view])
+        return out.to(self.anchor.device, non_blocking=True).float()
+
+    def forward(self, index, view, is_feat=False):
+        index = np.asarray(index)
+        view = np.asarray(view)
+        logit_t = self._lookup(self.logits, index, view)
+        if not is_feat:
+            return logit_t
+        feat_t = [self._lookup(f, index, view) for f in self.feats]
+        return feat_t, logit_t
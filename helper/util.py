@@ -1,5 +1,6 @@
 from __future__ import print_function
 
+import csv
 import json
 import torch
 import numpy as np
@@ -53,7 +54,7 @@ def accuracy(output, target, topk=(1,)):
 
         res = []
         for k in topk:
-            correct_k = correct[:k].view(-1).float().sum(0, keepdim=True)
+            correct_k = correct[:k].reshape(-1).float().sum(0, keepdim=True)
             res.append(correct_k.mul_(100.0 / batch_size))
         return res
 
@@ -69,6 +70,25 @@ def save_dict_to_json(d, json_path):
         d = {k: v for k, v in d.items()}
         json.dump(d, f, indent=4)
 
+def save_table(rows, path):
+    """Saves a list of dicts as a .csv table (columns in order of first appearance) or as json
+
+    Args:
+        rows: (list) of dicts of floats/strings
+        path: (string) .csv file, any other extension is written as json
+    """
+    if path.endswith('.csv'):
+        keys = []
+        for row in rows:
+            keys += [k for k in row if k not in keys]
+        with open(path, 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=keys)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=4)
+
 def load_json_to_dict(json_path):
     """Loads json file to dict 
 
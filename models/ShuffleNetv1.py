@@ -5,16 +5,53 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from .features import FeatureTaps
+
+
+class _ReluShuffle(torch.autograd.Function):
+    """relu followed by the channel shuffle, written straight into the shuffled layout
+
+    one pass forward (instead of relu + reshape copy) and one pass backward, and only the
+    shuffled output is kept for the backward
+    """
+    @staticmethod
+    def forward(ctx, x, g):
+        N, C, H, W = x.shape
+        out = x.new_empty(N, C//g, g, H, W)
+        torch.clamp_min(x.view(N, g, C//g, H, W).permute(0, 2, 1, 3, 4), 0, out=out)
+        out = out.view(N, C, H, W)
+        ctx.g = g
+        ctx.save_for_backward(out)
+        return out
+
+    @staticmethod
+    def backward(ctx, grad):
+        out, = ctx.saved_tensors
+        N, C, H, W = out.shape
+        g = ctx.g
+        grad_in = grad.new_empty(N, g, C//g, H, W)
+        torch.ops.aten.threshold_backward.grad_input(grad.reshape(N, C//g, g, H, W).permute(0, 2, 1, 3, 4),
+                                                     out.view(N, C//g, g, H, W).permute(0, 2, 1, 3, 4), 0,
+                                                     grad_input=grad_in)
+        return grad_in.view(N, C, H, W), None
+
 
 class ShuffleBlock(nn.Module):
     def __init__(self, groups):
         super(ShuffleBlock, self).__init__()
         self.groups = groups
+        # see ShuffleNet.fuse_shuffle
+        self.fused = False
 
-    def forward(self, x):
-        '''Channel shuffle: [N,C,H,W] -> [N,g,C/g,H,W] -> [N,C/g,g,H,w] -> [N,C,H,W]'''
+    def forward(self, x, relu=False):
+        '''Channel shuffle: [N,C,H,W] -> [N,g,C/g,H,W] -> [N,C/g,g,H,w] -> [N,C,H,W], with relu=True
+        applied to relu(x)'''
         N,C,H,W = x.size()
         g = self.groups
+        if relu and self.fused and g > 1:
+            return _ReluShuffle.apply(x, g)
+        if relu:
+            x = F.relu(x)
         return x.view(N,g,C//g,H,W).permute(0,2,1,3,4).reshape(N,C,H,W)
 
 
@@ -39,8 +76,7 @@ class Bottleneck(nn.Module):
             self.shortcut = nn.Sequential(nn.AvgPool2d(3, stride=2, padding=1))
 
     def forward(self, x):
-        out = F.relu(self.bn1(self.conv1(x)))
-        out = self.shuffle1(out)
+        out = self.shuffle1(self.bn1(self.conv1(x)), relu=True)
         out = F.relu(self.bn2(self.conv2(out)))
         out = self.bn3(self.conv3(out))
         res = self.shortcut(x)
@@ -89,28 +125,39 @@ class ShuffleNet(nn.Module):
         feat_m.append(self.layer3)
         return feat_m
 
+    def fuse_shuffle(self, fused=True):
+        """Run the relu + channel shuffle of every bottleneck as one pass (same outputs and
+        state_dict, one activation less kept for the backward). Not usable under torch.func.vmap."""
+        for m in self.modules():
+            if isinstance(m, ShuffleBlock):
+                m.fused = fused
+        return self
+
     def get_bn_before_relu(self):
         raise NotImplementedError('ShuffleNet currently is not supported for "Overhaul" teacher')
 
-    def forward(self, x, is_feat=False, preact=False):
+    def forward(self, x, is_feat=False, preact=False, features=None):
+        taps = FeatureTaps(5, features, is_feat)
         out = F.relu(self.bn1(self.conv1(x)))
-        f0 = out
-        out, f1_pre = self.layer1(out)
-        f1 = out
-        out, f2_pre = self.layer2(out)
-        f2 = out
-        out, f3_pre = self.layer3(out)
-        f3 = out
+        if taps.add(0, out):
+            return taps.feats, None
+        out, pre = self.layer1(out)
+        if taps.add(1, pre if preact else out):
+            return taps.feats, None
+        out, pre = self.layer2(out)
+        if taps.add(2, pre if preact else out):
+            return taps.feats, None
+        out, pre = self.layer3(out)
+        if taps.add(3, pre if preact else out):
+            return taps.feats, None
         out = F.avg_pool2d(out, 4)
         out = out.view(out.size(0), -1)
-        f4 = out
+        if taps.add(4, out):
+            return taps.feats, None
         out = self.linear(out)
 
-        if is_feat:
-            if preact:
-                return [f0, f1_pre, f2_pre, f3_pre, f4], out
-            else:
-                return [f0, f1, f2, f3, f4], out
+        if is_feat or features is not None:
+            return taps.feats, out
         else:
             return out
 
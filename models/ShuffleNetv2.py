@@ -5,14 +5,22 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from .features import FeatureTaps
+
 
 class ShuffleBlock(nn.Module):
     def __init__(self, groups=2):
         super(ShuffleBlock, self).__init__()
         self.groups = groups
 
-    def forward(self, x):
-        '''Channel shuffle: [N,C,H,W] -> [N,g,C/g,H,W] -> [N,C/g,g,H,w] -> [N,C,H,W]'''
+    def forward(self, x, *rest):
+        '''Channel shuffle: [N,C,H,W] -> [N,g,C/g,H,W] -> [N,C/g,g,H,w] -> [N,C,H,W]
+
+        forward(x_1, ..., x_g) shuffles torch.cat([x_1, ..., x_g], 1) of g equally wide
+        tensors, interleaving them in one copy instead of a cat and a reshape copy
+        '''
+        if rest:
+            return torch.stack((x,) + rest, 2).flatten(1, 2)
         N, C, H, W = x.size()
         g = self.groups
         return x.view(N, g, C//g, H, W).permute(0, 2, 1, 3, 4).reshape(N, C, H, W)
@@ -25,7 +33,8 @@ class SplitBlock(nn.Module):
 
     def forward(self, x):
         c = int(x.size(1) * self.ratio)
-        return x[:, :c, :, :], x[:, c:, :, :]
+        # one split node, its backward is a single cat instead of two zero-filled slice grads
+        return x.split([c, x.size(1) - c], 1)
 
 
 class BasicBlock(nn.Module):
@@ -52,11 +61,9 @@ class BasicBlock(nn.Module):
         preact = self.bn3(self.conv3(out))
         out = F.relu(preact)
         # out = F.relu(self.bn3(self.conv3(out)))
-        preact = torch.cat([x1, preact], 1)
-        out = torch.cat([x1, out], 1)
-        out = self.shuffle(out)
+        out = self.shuffle(x1, out)
         if self.is_last:
-            return out, preact
+            return out, torch.cat([x1, preact], 1)
         else:
             return out
 
@@ -93,9 +100,8 @@ class DownBlock(nn.Module):
         out2 = F.relu(self.bn3(self.conv3(x)))
         out2 = self.bn4(self.conv4(out2))
         out2 = F.relu(self.bn5(self.conv5(out2)))
-        # concat
-        out = torch.cat([out1, out2], 1)
-        out = self.shuffle(out)
+        # concat + shuffle
+        out = self.shuffle(out1, out2)
         return out
 
 
@@ -137,26 +143,29 @@ class ShuffleNetV2(nn.Module):
     def get_bn_before_relu(self):
         raise NotImplementedError('ShuffleNetV2 currently is not supported for "Overhaul" teacher')
 
-    def forward(self, x, is_feat=False, preact=False):
+    def forward(self, x, is_feat=False, preact=False, features=None):
+        taps = FeatureTaps(5, features, is_feat)
         out = F.relu(self.bn1(self.conv1(x)))
         # out = F.max_pool2d(out, 3, stride=2, padding=1)
-        f0 = out
-        out, f1_pre = self.layer1(out)
-        f1 = out
-        out, f2_pre = self.layer2(out)
-        f2 = out
-        out, f3_pre = self.layer3(out)
-        f3 = out
+        if taps.add(0, out):
+            return taps.feats, None
+        out, pre = self.layer1(out)
+        if taps.add(1, pre if preact else out):
+            return taps.feats, None
+        out, pre = self.layer2(out)
+        if taps.add(2, pre if preact else out):
+            return taps.feats, None
+        out, pre = self.layer3(out)
+        if taps.add(3, pre if preact else out):
+            return taps.feats, None
         out = F.relu(self.bn2(self.conv2(out)))
         out = F.avg_pool2d(out, 4)
         out = out.view(out.size(0), -1)
-        f4 = out
+        if taps.add(4, out):
+            return taps.feats, None
         out = self.linear(out)
-        if is_feat:
-            if preact:
-                return [f0, f1_pre, f2_pre, f3_pre, f4], out
-            else:
-                return [f0, f1, f2, f3, f4], out
+        if is_feat or features is not None:
+            return taps.feats, out
         else:
             return out
 
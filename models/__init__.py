@@ -1,45 +1,84 @@
-from .resnet import resnet8, resnet14, resnet20, resnet32, resnet44, resnet56, resnet110, resnet8x4, resnet32x4
-from .resnet import resnet8x4_double
-from .resnetv2 import resnet18, resnet34, resnet50, wide_resnet50_2, resnext50_32x4d, resnet34x4, resnet18x2
-from .wrn import wrn_16_1, wrn_16_2, wrn_40_1, wrn_40_2
-from .vgg import vgg19_bn, vgg16_bn, vgg13_bn, vgg11_bn, vgg8_bn
-from .vggv2 import vgg13_bn as vgg13_imagenet, vgg11_bn as vgg11_imagenet
-from .mobilenetv2 import mobile_half
-
-from .ShuffleNetv1 import ShuffleV1
-from .ShuffleNetv2 import ShuffleV2
-
-
-model_dict = {
-    'resnet8': resnet8,
-    'resnet14': resnet14,
-    'resnet20': resnet20,
-    'resnet32': resnet32,
-    'resnet44': resnet44,
-    'resnet56': resnet56,
-    'ResNet18': resnet18,
-    'ResNet18Double': resnet18x2,
-    'ResNet34': resnet34,
-    'ResNet50': resnet50,
-    'resnet110': resnet110,
-    'resnet8x4': resnet8x4,
-    'resnet8x4_double': resnet8x4_double,
-    'resnet32x4': resnet32x4,
-    'resnext50_32x4d': resnext50_32x4d,
-    'resnet34x4': resnet34x4,
-    'wrn_16_1': wrn_16_1,
-    'wrn_16_2': wrn_16_2,
-    'wrn_40_1': wrn_40_1,
-    'wrn_40_2': wrn_40_2,
-    'wrn_50_2': wide_resnet50_2,
-    'vgg8': vgg8_bn,
-    'vgg11': vgg11_bn,
-    'vgg13': vgg13_bn,
-    'vgg16': vgg16_bn,
-    'vgg19': vgg19_bn,
-    'vgg13_imagenet': vgg13_imagenet,
-    'vgg11_imagenet': vgg11_imagenet,
-    'MobileNetV2': mobile_half,
-    'ShuffleV1': ShuffleV1,
-    'ShuffleV2': ShuffleV2,
-}
+import importlib
+from collections import OrderedDict
+from collections.abc import Mapping
+
+
+# name -> (module, builder); a module is imported on the first lookup of one of its architectures
+_registry = OrderedDict([
+    ('resnet8', ('resnet', 'resnet8')),
+    ('resnet14', ('resnet', 'resnet14')),
+    ('resnet20', ('resnet', 'resnet20')),
+    ('resnet32', ('resnet', 'resnet32')),
+    ('resnet44', ('resnet', 'resnet44')),
+    ('resnet56', ('resnet', 'resnet56')),
+    ('ResNet18', ('resnetv2', 'resnet18')),
+    ('ResNet18Double', ('resnetv2', 'resnet18x2')),
+    ('ResNet34', ('resnetv2', 'resnet34')),
+    ('ResNet50', ('resnetv2', 'resnet50')),
+    ('resnet110', ('resnet', 'resnet110')),
+    ('resnet8x4', ('resnet', 'resnet8x4')),
+    ('resnet8x4_double', ('resnet', 'resnet8x4_double')),
+    ('resnet32x4', ('resnet', 'resnet32x4')),
+    ('resnext50_32x4d', ('resnetv2', 'resnext50_32x4d')),
+    ('resnet34x4', ('resnetv2', 'resnet34x4')),
+    ('wrn_16_1', ('wrn', 'wrn_16_1')),
+    ('wrn_16_2', ('wrn', 'wrn_16_2')),
+    ('wrn_40_1', ('wrn', 'wrn_40_1')),
+    ('wrn_40_2', ('wrn', 'wrn_40_2')),
+    ('wrn_50_2', ('resnetv2', 'wide_resnet50_2')),
+    ('vgg8', ('vgg', 'vgg8_bn')),
+    ('vgg11', ('vgg', 'vgg11_bn')),
+    ('vgg13', ('vgg', 'vgg13_bn')),
+    ('vgg16', ('vgg', 'vgg16_bn')),
+    ('vgg19', ('vgg', 'vgg19_bn')),
+    ('vgg13_imagenet', ('vggv2', 'vgg13_bn')),
+    ('vgg11_imagenet', ('vggv2', 'vgg11_bn')),
+    ('MobileNetV2', ('mobilenetv2', 'mobile_half')),
+    ('ShuffleV1', ('ShuffleNetv1', 'ShuffleV1')),
+    ('ShuffleV2', ('ShuffleNetv2', 'ShuffleV2')),
+])
+
+# builders this package used to import eagerly, still reachable as models.<name>
+_exports = {}
+for _module, _attr in _registry.values():
+    _exports.setdefault(_attr, (_module, _attr))
+_exports['vgg13_imagenet'] = _registry['vgg13_imagenet']
+_exports['vgg11_imagenet'] = _registry['vgg11_imagenet']
+
+
+def _load(module, attr):
+    return getattr(importlib.import_module('.' + module, __name__), attr)
+
+
+class LazyModelDict(Mapping):
+    """read-only architecture name -> model builder, importing the module of an architecture
+    only when it is first looked up"""
+    def __init__(self, registry):
+        self._registry = registry
+        self._cache = {}
+
+    def __getitem__(self, name):
+        if name not in self._cache:
+            self._cache[name] = _load(*self._registry[name])
+        return self._cache[name]
+
+    def __iter__(self):
+        return iter(self._registry)
+
+    def __len__(self):
+        return len(self._registry)
+
+    def __contains__(self, name):
+        return name in self._registry
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, list(self._registry))
+
+
+model_dict = LazyModelDict(_registry)
+
+
+def __getattr__(name):
+    if name in _exports:
+        return _load(*_exports[name])
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
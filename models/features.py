@@ -0,0 +1,40 @@
+from __future__ import print_function
+
+
+class FeatureTaps(object):
+    """Collects the feature maps asked for by forward(x, ..., features=...)
+
+    Args:
+        n_feat: number of feature maps the model returns with is_feat=True
+        features: None keeps the usual behavior (every feature map if is_feat, none
+            otherwise). Otherwise an iterable of stage indices (negative ones count from
+            the end, -1 being the pooled embedding before the classifier) and/or 'logit'.
+            Stages that are not asked for are not kept alive, and when 'logit' is not asked
+            for the forward stops right after the last requested stage.
+        is_feat: the is_feat argument of the forward
+    """
+    def __init__(self, n_feat, features=None, is_feat=True):
+        self.feats = [None] * n_feat
+        if features is None:
+            self.keep = set(range(n_feat)) if is_feat else set()
+            self.last = n_feat
+            return
+        self.keep = set()
+        logit = False
+        for f in features:
+            if f == 'logit':
+                logit = True
+            elif -n_feat <= f < n_feat:
+                self.keep.add(f % n_feat)
+            else:
+                raise IndexError('feature {} out of range for a model with {} feature maps'.format(f, n_feat))
+        self.last = n_feat if logit else max(self.keep, default=-1)
+
+    def wants(self, i):
+        return i in self.keep
+
+    def add(self, i, f):
+        """record feature map i if it was asked for, returns True when the forward can stop"""
+        if i in self.keep:
+            self.feats[i] = f
+        return i >= self.last
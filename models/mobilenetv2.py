@@ -7,6 +7,8 @@ import torch
 import torch.nn as nn
 import math
 
+from .features import FeatureTaps
+
 __all__ = ['mobilenetv2_T_w', 'mobile_half']
 
 BN = None
@@ -129,33 +131,40 @@ class MobileNetV2(nn.Module):
         feat_m.append(self.blocks)
         return feat_m
 
-    def forward(self, x, is_feat=False, preact=False):
+    def forward(self, x, is_feat=False, preact=False, features=None):
+        taps = FeatureTaps(6, features, is_feat)
 
         out = self.conv1(x)
-        f0 = out
+        if taps.add(0, out):
+            return taps.feats, None
 
         out = self.blocks[0](out)
         out = self.blocks[1](out)
-        f1 = out
+        if taps.add(1, out):
+            return taps.feats, None
         out = self.blocks[2](out)
-        f2 = out
+        if taps.add(2, out):
+            return taps.feats, None
         out = self.blocks[3](out)
         out = self.blocks[4](out)
-        f3 = out
+        if taps.add(3, out):
+            return taps.feats, None
         out = self.blocks[5](out)
         out = self.blocks[6](out)
-        f4 = out
+        if taps.add(4, out):
+            return taps.feats, None
 
         out = self.conv2(out)
 
         if not self.remove_avg:
             out = self.avgpool(out)
         out = out.view(out.size(0), -1)
-        f5 = out
+        if taps.add(5, out):
+            return taps.feats, None
         out = self.classifier(out)
 
-        if is_feat:
-            return [f0, f1, f2, f3, f4, f5], out
+        if is_feat or features is not None:
+            return taps.feats, out
         else:
             return out
 
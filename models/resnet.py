@@ -11,6 +11,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 import math
 
+from .features import FeatureTaps
+
 
 __all__ = ['resnet']
 
@@ -175,29 +177,32 @@ class ResNet(nn.Module):
 
         return [bn1, bn2, bn3]
 
-    def forward(self, x, is_feat=False, preact=False):
+    def forward(self, x, is_feat=False, preact=False, features=None):
+        taps = FeatureTaps(5, features, is_feat)
         x = self.conv1(x)
         x = self.bn1(x)
         x = self.relu(x)  # 32x32
-        f0 = x
-
-        x, f1_pre = self.layer1(x)  # 32x32
-        f1 = x
-        x, f2_pre = self.layer2(x)  # 16x16
-        f2 = x
-        x, f3_pre = self.layer3(x)  # 8x8
-        f3 = x
+        if taps.add(0, x):
+            return taps.feats, None
+
+        x, pre = self.layer1(x)  # 32x32
+        if taps.add(1, pre if preact else x):
+            return taps.feats, None
+        x, pre = self.layer2(x)  # 16x16
+        if taps.add(2, pre if preact else x):
+            return taps.feats, None
+        x, pre = self.layer3(x)  # 8x8
+        if taps.add(3, pre if preact else x):
+            return taps.feats, None
 
         x = self.avgpool(x)
         x = x.view(x.size(0), -1)
-        f4 = x
+        if taps.add(4, x):
+            return taps.feats, None
         x = self.fc(x)
 
-        if is_feat:
-            if preact:
-                return [f0, f1_pre, f2_pre, f3_pre, f4], x
-            else:
-                return [f0, f1, f2, f3, f4], x
+        if is_feat or features is not None:
+            return taps.feats, x
         else:
             return x
 
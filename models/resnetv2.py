@@ -6,6 +6,8 @@
 import torch
 import torch.nn as nn
 
+from .features import FeatureTaps
+
 # https://github.com/pytorch/vision/blob/master/torchvision/models/utils.py
 try:
     from torch.hub import load_state_dict_from_url
@@ -227,28 +229,35 @@ class ResNet(nn.Module):
 
         return x
 
-    def forward(self, x, is_feat=False):
-        if is_feat:
+    def forward(self, x, is_feat=False, features=None):
+        if is_feat or features is not None:
+            taps = FeatureTaps(6, features)
             x = self.conv1(x)
             x = self.bn1(x)
             x = self.relu(x)
             x = self.maxpool(x)
-            f0 = x
+            if taps.add(0, x):
+                return taps.feats, None
 
             x = self.layer1(x)
-            f1 = x
+            if taps.add(1, x):
+                return taps.feats, None
             x = self.layer2(x)
-            f2 = x
+            if taps.add(2, x):
+                return taps.feats, None
             x = self.layer3(x)
-            f3 = x
+            if taps.add(3, x):
+                return taps.feats, None
             x = self.layer4(x)
-            f4 = x
+            if taps.add(4, x):
+                return taps.feats, None
 
             x = self.avgpool(x)
             x = torch.flatten(x, 1)
-            f5 = x
+            if taps.add(5, x):
+                return taps.feats, None
             x = self.fc(x)
-            return [f0, f1, f2, f3, f4, f5], x
+            return taps.feats, x
         else:
             return self._forward_impl(x)
 
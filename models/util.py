@@ -5,6 +5,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 import math
 
+from distiller_zoo.relation import relation_cache
+
 class ConvReg(nn.Module):
     """Convolutional regression for FitNet (feature map layer)"""
     def __init__(self, s_shape, t_shape, use_relu=True):
@@ -67,54 +69,65 @@ class SelfA(nn.Module):
             for j in range(t_len):
                 setattr(self, 'regressor'+str(i)+str(j), AAEmbed(s_n[i], s_t[j]))
                
+    @staticmethod
+    def _similarity(feat):
+        """stacked BxB similarity matrices of a list of feature maps, L x B x B
+
+        the (detached) teacher maps are looked up in relation_cache, so they are computed once
+        per batch for all students
+        """
+        return torch.stack([relation_cache(f, 'gram') for f in feat])
+
+    @staticmethod
+    def _embed(embeds, x):
+        """apply the i-th MLPEmbed of `embeds` to x[i] (L x B x dim_in) as two batched matmuls"""
+        w1 = torch.stack([e.linear1.weight for e in embeds]).transpose(1, 2)
+        b1 = torch.stack([e.linear1.bias for e in embeds]).unsqueeze(1)
+        w2 = torch.stack([e.linear2.weight for e in embeds]).transpose(1, 2)
+        b2 = torch.stack([e.linear2.bias for e in embeds]).unsqueeze(1)
+        x = torch.baddbmm(b1, x, w1).relu_()
+        x = torch.baddbmm(b2, x, w2)
+        # same as Normalize(2) on every row
+        return x.div(x.pow(2).sum(2, keepdim=True).pow(0.5))
+
     def forward(self, feat_s, feat_t):
         
-        sim_t = list(range(len(feat_t)))
-        sim_s = list(range(len(feat_s)))
-        bsz = feat_s[0].shape[0]
-        # similarity matrix
-        for i in range(len(feat_t)):
-            sim_temp = feat_t[i].reshape(bsz, -1)
-            sim_t[i] = torch.matmul(sim_temp, sim_temp.t())
-        for i in range(len(feat_s)):
-            sim_temp = feat_s[i].reshape(bsz, -1)
-            sim_s[i] = torch.matmul(sim_temp, sim_temp.t())
-        
-        # key of target layers    
-        proj_key = self.key_weight0(sim_t[0])
-        proj_key = proj_key[:, :, None]
-        
-        for i in range(1, len(sim_t)):
-            temp_proj_key = getattr(self, 'key_weight'+str(i))(sim_t[i])
-            proj_key =  torch.cat([proj_key, temp_proj_key[:, :, None]], 2)
-        
-        # query of source layers   
-        proj_query = self.query_weight0(sim_s[0])
-        proj_query = proj_query[:, None, :]
-        for i in range(1, len(sim_s)):
-            temp_proj_query = getattr(self, 'query_weight'+str(i))(sim_s[i])
-            proj_query = torch.cat([proj_query, temp_proj_query[:, None, :]], 1)
+        # key of target layers and query of source layers
+        keys = [getattr(self, 'key_weight'+str(i)) for i in range(len(feat_t))]
+        queries = [getattr(self, 'query_weight'+str(i)) for i in range(len(feat_s))]
+        proj_key = self._embed(keys, self._similarity(feat_t)).permute(1, 2, 0)
+        proj_query = self._embed(queries, self._similarity(feat_s)).permute(1, 0, 2)
         
         # attention weight
         energy = torch.bmm(proj_query, proj_key) # batch_size X No.stu feature X No.tea feature
         attention = F.softmax(energy, dim = -1)
         
-        # feature space alignment
+        # feature space alignment: pair (i, j) is compared at resolution min(s_H, t_H), every
+        # teacher map is pooled once per resolution and the regressors of student layer i that
+        # share an input run their first 1x1 conv as a single convolution
+        pooled_t = {}
         proj_value_stu = []
         value_tea = []
-        for i in range(len(sim_s)):
-            proj_value_stu.append([])
-            value_tea.append([])
-            for j in range(len(sim_t)):            
-                s_H, t_H = feat_s[i].shape[2], feat_t[j].shape[2]
-                if s_H > t_H:
-                    input = F.adaptive_avg_pool2d(feat_s[i], (t_H, t_H))
-                    proj_value_stu[i].append(getattr(self, 'regressor'+str(i)+str(j))(input))
-                    value_tea[i].append(feat_t[j])
-                elif s_H < t_H or s_H == t_H:
-                    target = F.adaptive_avg_pool2d(feat_t[j], (s_H, s_H))
-                    proj_value_stu[i].append(getattr(self, 'regressor'+str(i)+str(j))(feat_s[i]))
-                    value_tea[i].append(target)
+        for i in range(len(feat_s)):
+            s_H = feat_s[i].shape[2]
+            groups = {}
+            for j in range(len(feat_t)):
+                groups.setdefault(min(s_H, feat_t[j].shape[2]), []).append(j)
+            proj_value_stu.append([None] * len(feat_t))
+            value_tea.append([None] * len(feat_t))
+            for size, js in groups.items():
+                input = feat_s[i] if size == s_H else F.adaptive_avg_pool2d(feat_s[i], (size, size))
+                regressors = [getattr(self, 'regressor'+str(i)+str(j)).regressor for j in js]
+                weight = torch.cat([r[0].weight for r in regressors]) if len(js) > 1 else regressors[0][0].weight
+                mid = F.conv2d(input, weight).split([r[0].out_channels for r in regressors], 1)
+                for j, regressor, x in zip(js, regressors, mid):
+                    for layer in list(regressor)[1:]:
+                        x = layer(x)
+                    proj_value_stu[i][j] = x
+                    if (j, size) not in pooled_t:
+                        t_H = feat_t[j].shape[2]
+                        pooled_t[j, size] = feat_t[j] if size == t_H else F.adaptive_avg_pool2d(feat_t[j], (size, size))
+                    value_tea[i][j] = pooled_t[j, size]
                 
         return proj_value_stu, value_tea, attention
            
@@ -5,6 +5,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 import math
 
+from .features import FeatureTaps
+
 
 __all__ = [
     'VGG', 'vgg11', 'vgg11_bn', 'vgg13', 'vgg13_bn', 'vgg16', 'vgg16_bn',
@@ -61,41 +63,45 @@ class VGG(nn.Module):
         bn4 = self.block4[-1]
         return [bn1, bn2, bn3, bn4]
 
-    def forward(self, x, is_feat=False, preact=False):
+    def forward(self, x, is_feat=False, preact=False, features=None):
+        taps = FeatureTaps(6, features, is_feat)
         h = x.shape[2]
         x = F.relu(self.block0(x))
-        f0 = x
+        if taps.add(0, x):
+            return taps.feats, None
         x = self.pool0(x)
         x = self.block1(x)
-        f1_pre = x
+        pre = x
         x = F.relu(x)
-        f1 = x
+        if taps.add(1, pre if preact else x):
+            return taps.feats, None
         x = self.pool1(x)
         x = self.block2(x)
-        f2_pre = x
+        pre = x
         x = F.relu(x)
-        f2 = x
+        if taps.add(2, pre if preact else x):
+            return taps.feats, None
         x = self.pool2(x)
         x = self.block3(x)
-        f3_pre = x
+        pre = x
         x = F.relu(x)
-        f3 = x
+        if taps.add(3, pre if preact else x):
+            return taps.feats, None
         if h == 64:
             x = self.pool3(x)
         x = self.block4(x)
-        f4_pre = x
+        pre = x
         x = F.relu(x)
-        f4 = x
+        if taps.add(4, pre if preact else x):
+            return taps.feats, None
         x = self.pool4(x)
         x = x.view(x.size(0), -1)
-        f5 = x
+        if taps.add(5, x):
+            return taps.feats, None
         x = self.classifier(x)
 
-        if is_feat:
-            if preact:
-                return [f0, f1_pre, f2_pre, f3_pre, f4_pre, f5], x
-            else:
-                return [f0, f1, f2, f3, f4, f5], x
+        if is_feat or features is not None:
+            return taps.feats, x
         else:
             return x
 
@@ -6,6 +6,8 @@
 import torch
 import torch.nn as nn
 
+from .features import FeatureTaps
+
 # https://github.com/pytorch/vision/blob/master/torchvision/models/utils.py
 try:
     from torch.hub import load_state_dict_from_url
@@ -50,25 +52,26 @@ class VGG(nn.Module):
         if init_weights:
             self._initialize_weights()
 
-    def forward(self, x, is_feat=False):
-        hidden_layers = []
-        for left, right in zip(self.split, self.split[1:]):
-            for module in self.features[left:right]:
-                x = module(x)
-            hidden_layers.append(x)
+    def forward(self, x, is_feat=False, features=None):
+        stages = list(zip(self.split, self.split[1:]))
         if self.split[-1] < len(self.features):
-            for module in self.features[self.split[-1]:]:
+            stages.append((self.split[-1], len(self.features)))
+        taps = FeatureTaps(len(stages) + 1, features, is_feat)
+        for i, (left, right) in enumerate(stages):
+            for module in self.features[left:right]:
                 x = module(x)
-            hidden_layers.append(x)
+            if taps.add(i, x):
+                return taps.feats, None
 
         x = self.avgpool(x)
         x = torch.flatten(x, 1)
-        hidden_layers.append(x)
+        if taps.add(len(stages), x):
+            return taps.feats, None
         x = self.classifier(x)
         
-        if not is_feat:
+        if not is_feat and features is None:
             return x
-        return hidden_layers, x
+        return taps.feats, x
 
     def _initialize_weights(self):
         for m in self.modules():
@@ -3,6 +3,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from .features import FeatureTaps
+
 """
 Original Author: Wei Yang
 """
@@ -100,26 +102,28 @@ class WideResNet(nn.Module):
 
         return [bn1, bn2, bn3]
 
-    def forward(self, x, is_feat=False, preact=False):
+    def forward(self, x, is_feat=False, preact=False, features=None):
+        taps = FeatureTaps(5, features, is_feat)
         out = self.conv1(x)
-        f0 = out
+        if taps.add(0, out):
+            return taps.feats, None
         out = self.block1(out)
-        f1 = out
+        if taps.add(1, self.block2.layer[0].bn1(out) if preact and taps.wants(1) else out):
+            return taps.feats, None
         out = self.block2(out)
-        f2 = out
+        if taps.add(2, self.block3.layer[0].bn1(out) if preact and taps.wants(2) else out):
+            return taps.feats, None
         out = self.block3(out)
-        f3 = out
+        if taps.add(3, self.bn1(out) if preact and taps.wants(3) else out):
+            return taps.feats, None
         out = self.relu(self.bn1(out))
         out = F.avg_pool2d(out, 8)
         out = out.view(-1, self.nChannels)
-        f4 = out
+        if taps.add(4, out):
+            return taps.feats, None
         out = self.fc(out)
-        if is_feat:
-            if preact:
-                f1 = self.block2.layer[0].bn1(f1)
-                f2 = self.block3.layer[0].bn1(f2)
-                f3 = self.bn1(f3)
-            return [f0, f1, f2, f3, f4], out
+        if is_feat or features is not None:
+            return taps.feats, out
         else:
             return out
 
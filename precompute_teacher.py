@@ -0,0 +1,83 @@
+"""
+precompute the outputs of a frozen teacher for every CIFAR-100 training image and augmentation view,
+used by train_student.py / the GR script with --teacher_cache
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import argparse
+
+import torch
+from torchvision import datasets
+
+from models import model_dict
+from dataset.cifar100 import get_data_folder
+from helper.teacher_cache import precompute_teacher_cache, CACHED_FEATS
+
+split_symbol = '~' if os.name == 'nt' else ':'
+
+
+def parse_option():
+
+    parser = argparse.ArgumentParser('argument for teacher output caching')
+
+    parser.add_argument('--path-t', type=str, required=True, help='teacher model snapshot')
+    parser.add_argument('--distill', type=str, default='kd', choices=list(CACHED_FEATS.keys()),
+                        help='the distiller whose teacher features are stored besides the logits')
+    parser.add_argument('--cache_path', type=str, default=None, help='output directory of the cache')
+    parser.add_argument('--batch_size', type=int, default=256, help='batch_size')
+    parser.add_argument('--dtype', type=str, default='float16', choices=['float16', 'float32'])
+
+    opt = parser.parse_args()
+
+    opt.model_t = get_teacher_name(opt.path_t)
+    if opt.cache_path is None:
+        opt.cache_path = './save/teacher_cache/{}_{}'.format(opt.model_t, opt.distill)
+
+    return opt
+
+
+def get_teacher_name(model_path):
+    """parse teacher name"""
+    directory = model_path.split('/')[-2]
+    pattern = ''.join(['S', split_symbol, '(.+)', '_T', split_symbol])
+    name_match = re.match(pattern, directory)
+    if name_match:
+        return name_match[1]
+    segments = directory.split('_')
+    if segments[0] == 'wrn':
+        return segments[0] + '_' + segments[1] + '_' + segments[2]
+    if segments[0] == 'resnext50':
+        return segments[0] + '_' + segments[1]
+    if segments[0] == 'vgg13' and segments[1] == 'imagenet':
+        return segments[0] + '_' + segments[1]
+    return segments[0]
+
+
+def load_teacher(model_path, n_cls):
+    print('==> loading teacher model')
+    model_t = get_teacher_name(model_path)
+    model = model_dict[model_t](num_classes=n_cls)
+    model.load_state_dict(torch.load(model_path, map_location='cpu')['model'])
+    print('==> done')
+    return model
+
+
+def main():
+    opt = parse_option()
+
+    model_t = load_teacher(opt.path_t, 100)
+    model_t.eval()
+    if torch.cuda.is_available():
+        model_t.cuda()
+
+    train_set = datasets.CIFAR100(root=get_data_folder(), download=True, train=True)
+    precompute_teacher_cache(model_t, train_set.data, opt.cache_path, distill=opt.distill,
+                             batch_size=opt.batch_size, dtype=opt.dtype, model_name=opt.model_t)
+    print('==> teacher cache written to {}'.format(opt.cache_path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+cost table of model_dict architectures: parameters and MACs per layer group, peak activation
+memory of inference and training, and measured CPU forward / forward+backward latency
+"""
+
+from __future__ import print_function
+
+import argparse
+
+import torch
+
+from models import model_dict
+from helper.cost import group_costs, activation_memory, step_latency
+from helper.util import save_table
+
+
+def parse_option():
+
+    parser = argparse.ArgumentParser('argument for architecture profiling')
+
+    parser.add_argument('--model', type=str, nargs='+', default=None, choices=list(model_dict.keys()),
+                        help='architectures to profile (default: every model_dict entry)')
+    parser.add_argument('--batch_size', type=int, nargs='+', default=[1, 64], help='batch sizes to measure')
+    parser.add_argument('--input_size', type=int, default=32, help='input height/width')
+    parser.add_argument('--n_cls', type=int, default=100, help='number of classes')
+    parser.add_argument('--groups', type=str, default=None,
+                        help="comma-separated layer groups as in --exc_groups, e.g. 'conv1+bn1+layer1,layer2,layer3+linear' "
+                             "(default: one group per top-level module)")
+    parser.add_argument('--n_iter', type=int, default=10, help='timed steps per measurement')
+    parser.add_argument('--threads', type=int, default=None, help='torch CPU threads')
+    parser.add_argument('--no_latency', dest='latency', action='store_false', help='skip the timing')
+    parser.add_argument('--output', type=str, default='model_costs.csv', help='results table, .csv or .json')
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+def main():
+    opt = parse_option()
+    if opt.threads is not None:
+        torch.set_num_threads(opt.threads)
+    groups = opt.groups.split(',') if opt.groups is not None else None
+
+    rows = []
+    for name in (opt.model or model_dict.keys()):
+        torch.manual_seed(0)
+        model = model_dict[name](num_classes=opt.n_cls)
+        size = (3, opt.input_size, opt.input_size)
+        costs = group_costs(model, torch.randn((1,) + size), groups)
+        params = sum(c['params'] for c in costs.values())
+        macs = sum(c['macs'] for c in costs.values())
+        print('{}: {:.3f}M params, {:.1f}M MACs/image ({})'.format(
+            name, params / 1e6, macs / 1e6, ', '.join('{} {:.1f}M'.format(g, c['macs'] / 1e6) for g, c in costs.items())))
+
+        for bsz in opt.batch_size:
+            x = torch.randn((bsz,) + size)
+            row = {'model': name, 'batch_size': bsz, 'params': params, 'macs_per_image': macs}
+            for g, c in costs.items():
+                row['params[{}]'.format(g)] = c['params']
+                row['macs[{}]'.format(g)] = c['macs']
+            try:
+                mem = activation_memory(model, x)
+                if opt.latency:
+                    latency = step_latency(model, x, n_iter=opt.n_iter)
+            except ValueError as e:
+                # e.g. BatchNorm in train mode on a single 1x1 sample
+                print('  batch {}: {}'.format(bsz, e))
+                rows.append(row)
+                continue
+            row['infer_peak_mb'] = mem['infer_peak'] / 2. ** 20
+            row['train_peak_mb'] = mem['train_peak'] / 2. ** 20
+            row['train_saved_mb'] = mem['train_saved'] / 2. ** 20
+            line = '  batch {}: activations {:.1f} MB inference, {:.1f} MB training ({:.1f} MB saved for backward)'.format(
+                bsz, row['infer_peak_mb'], row['train_peak_mb'], row['train_saved_mb'])
+            if opt.latency:
+                row['forward_ms'] = latency['forward'] * 1e3
+                row['forward_backward_ms'] = latency['forward_backward'] * 1e3
+                line += ', {:.1f} ms forward, {:.1f} ms forward+backward'.format(row['forward_ms'], row['forward_backward_ms'])
+            rows.append(row)
+            print(line)
+
+    save_table(rows, opt.output)
+    print('==> cost table written to {}'.format(opt.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+post-training static int8 quantization of trained students (e.g. GR_weight/*_best.pth),
+reporting fp32 vs int8 CIFAR-100 accuracy, per-image CPU latency and model size
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import argparse
+
+import torch
+
+from models import model_dict
+from dataset.cifar100 import get_cifar100_dataloaders, get_data_folder, CIFAR100BackCompat
+from helper.deploy import get_model_name, load_model, serialized_size
+from helper.fuse import measure_latency
+from helper.quantize import calibration_set, quantize_static, evaluate
+
+
+def parse_option():
+
+    parser = argparse.ArgumentParser('argument for post-training quantization')
+
+    parser.add_argument('--path', type=str, nargs='+', required=True, help='model snapshot(s)')
+    parser.add_argument('--model', type=str, default=None, choices=list(model_dict.keys()),
+                        help='architecture, parsed from the snapshot name when omitted')
+    parser.add_argument('--engine', type=str, default='onednn', choices=torch.backends.quantized.supported_engines,
+                        help='quantized CPU kernels')
+    parser.add_argument('--calib_size', type=int, default=1024, help='training images used for calibration')
+    parser.add_argument('--calib_seed', type=int, default=0, help='seed of the calibration subset')
+    parser.add_argument('--calib_cache', type=str, default=None, help='.npy file of the calibration subset')
+    parser.add_argument('--batch_size', type=int, default=128, help='batch size of calibration and evaluation')
+    parser.add_argument('--num_workers', type=int, default=4, help='num of workers of the test loader')
+    parser.add_argument('--shared_data', action='store_true', help='open CIFAR from the memory-mapped fast-start layout')
+    parser.add_argument('--no_eval', dest='eval', action='store_false', help='skip the test-set accuracy')
+    parser.add_argument('--n_iter', type=int, default=100, help='timed single-image forwards')
+    parser.add_argument('--threads', type=int, default=None, help='torch CPU threads')
+    parser.add_argument('--save_dir', type=str, default='./save/quantized', help='where the int8 TorchScript modules go')
+    parser.add_argument('--report', type=str, default=None, help='json file of the results')
+
+    opt = parser.parse_args()
+
+    if opt.calib_cache is None:
+        opt.calib_cache = './save/calibration/cifar100_train_{}_seed{}.npy'.format(opt.calib_size, opt.calib_seed)
+
+    return opt
+
+
+def main():
+    opt = parse_option()
+    if opt.threads is not None:
+        torch.set_num_threads(opt.threads)
+
+    data = None
+    if not os.path.isfile(opt.calib_cache):
+        data = CIFAR100BackCompat(root=get_data_folder(), train=True, download=True, shared=opt.shared_data).data
+    calib = calibration_set(opt.calib_cache, opt.calib_size, opt.calib_seed, data)
+    val_loader = None
+    if opt.eval:
+        _, val_loader = get_cifar100_dataloaders(batch_size=2 * opt.batch_size, num_workers=opt.num_workers,
+                                                 shared=opt.shared_data)
+    if not os.path.isdir(opt.save_dir):
+        os.makedirs(opt.save_dir)
+
+    x = torch.randn(1, 3, 32, 32)
+    results = []
+    for path in opt.path:
+        model_name = opt.model or get_model_name(path)
+        model = load_model(path, model_name)
+        qmodel = quantize_static(model, calib, batch_size=opt.batch_size, engine=opt.engine)
+        save_file = os.path.join(opt.save_dir, os.path.splitext(os.path.basename(path))[0] + '_int8.pt')
+        torch.jit.save(qmodel, save_file)
+
+        row = {'path': path, 'model': model_name, 'engine': opt.engine, 'int8_file': save_file}
+        for tag, m in (('fp32', model), ('int8', qmodel)):
+            if val_loader is not None:
+                row[tag + '_top1'], row[tag + '_top5'] = evaluate(m, val_loader)
+            row[tag + '_ms_per_image'] = measure_latency(m, x, n_iter=opt.n_iter) * 1e3
+            row[tag + '_size_mb'] = serialized_size(m) / 2. ** 20
+        results.append(row)
+
+        line = '{} [{}]'.format(path, model_name)
+        for tag in ('fp32', 'int8'):
+            line += '\n  {}: {:.3f} ms/image, {:.2f} MB'.format(tag, row[tag + '_ms_per_image'], row[tag + '_size_mb'])
+            if val_loader is not None:
+                line += ', Acc@1 {:.2f} Acc@5 {:.2f}'.format(row[tag + '_top1'], row[tag + '_top5'])
+        print(line)
+
+    if opt.report is not None:
+        with open(opt.report, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
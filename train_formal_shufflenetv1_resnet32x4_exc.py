@@ -28,12 +28,15 @@ from dataset.cifar100 import get_cifar100_dataloaders, get_cifar100_dataloaders_
 # from dataset.imagenet import get_imagenet_dataloader, imagenet_list
 # from dataset.imagenet_dali import get_dali_data_loader
 
+from helper.teacher_cache import TeacherCache
 from helper.util import adjust_learning_rate, save_dict_to_json, reduce_tensor, Logger
 
 from distiller_zoo import DistillKL, RKDLoss, SemCKDLoss
 from crd.criterion import CRDLoss
 
-from helper.loops import train_distill as train, validate
+from helper.loops import train_distill_population, train_distill_vmap, validate
+from helper.population import StudentPopulation
+from helper.recombine import layer_group_pairs, swap_tensor_pairs
 
 split_symbol = '~' if os.name == 'nt' else ':'
 
@@ -48,6 +51,10 @@ def parse_option():
     parser.add_argument('--num_workers', type=int, default=8, help='num of workers to use')
     parser.add_argument('--epochs', type=int, default=240, help='number of training epochs')
     parser.add_argument('--exc_epoch', type=int, default=10,help='exchange parmater epoch')
+    parser.add_argument('--population', type=int, default=0,
+                        help='train this many students as one vmap-batched population (0: the two-student loop)')
+    parser.add_argument('--exc_groups', type=str, default='conv1+bn1+layer1,layer2,layer3+linear',
+                        help='comma separated layer groups to exchange, modules inside a group joined by +')
     parser.add_argument('--gpu_id', type=str, default='0', help='id(s) for CUDA_VISIBLE_DEVICES')
 
     # optimization
@@ -80,6 +87,10 @@ def parse_option():
 
     # KL distillation
     parser.add_argument('--kd_T', type=float, default=4, help='temperature for KD distillation')
+    parser.add_argument('--teacher_cache', type=str, default=None,
+                        help='read teacher outputs from a cache written by precompute_teacher.py')
+    parser.add_argument('--aug_seed', type=int, default=None,
+                        help='draw crop/flip from a seeded per-(epoch, index) generator, replayable across runs')
 
     # NCE distillation
     parser.add_argument('--feat_dim', default=128, type=int, help='feature dimension')
@@ -87,6 +98,13 @@ def parse_option():
     parser.add_argument('--nce_k', default=16384, type=int, help='number of negative samples for NCE')
     parser.add_argument('--nce_t', default=0.07, type=float, help='temperature parameter for softmax')
     parser.add_argument('--nce_m', default=0.5, type=float, help='momentum for non-parametric updates')
+    parser.add_argument('--nce_bank_dtype', default='float32', type=str, choices=['float32', 'float16', 'bfloat16'],
+                        help='storage dtype of the CRD memory bank')
+    parser.add_argument('--nce_bank_path', default=None, type=str,
+                        help='keep the CRD memory bank in memory-mapped files in this directory')
+
+    # RKD distillation
+    parser.add_argument('--rkd_chunk', default=0, type=int, help='anchors per chunk of the RKD angle loss, 0 for no chunking')
 
     # hint layer
     parser.add_argument('--hint_layer', default=1, type=int, choices=[0, 1, 2, 3, 4])
@@ -99,6 +117,8 @@ def parse_option():
     parser.add_argument('--no_edge_transform', action='store_true') # default=false
     
     parser.add_argument('--use-lmdb', action='store_true') # default=false
+    parser.add_argument('--tensor_aug', action='store_true', help='augment whole batches on the uint8 array, no PIL/workers')
+    parser.add_argument('--shared_data', action='store_true', help='open CIFAR from the memory-mapped fast-start layout, shared by workers and trials')
 
     parser.add_argument('--dali', type=str, choices=['cpu', 'gpu'], default=None)
 
@@ -113,6 +133,8 @@ def parse_option():
     parser.add_argument('--deterministic', action='store_true', help='Make results reproducible')
 
     parser.add_argument('--skip-validation', action='store_true', help='Skip validation of teacher')
+    parser.add_argument('--fuse_eval', action='store_true', help='validate with the conv-BN pairs folded (helper.fuse.inference_fuse)')
+    parser.add_argument('--fused_shuffle', action='store_true', help='ShuffleV1: run relu + channel shuffle as one pass (same outputs)')
 
     parser.add_argument('--hkd_initial_weight', default=100, type=float, help='Initial layer weight for HKD method')
     parser.add_argument('--hkd_decay', default=0.7, type=float, help='Layer weight decay for HKD method')
@@ -123,6 +145,26 @@ def parse_option():
     if opt.model_s in ['MobileNetV2', 'ShuffleV1', 'ShuffleV2']:
         opt.learning_rate = 0.01
 
+    if opt.fused_shuffle and opt.model_s != 'ShuffleV1':
+        # ShuffleV2 already shuffles as one copy fused with its concat
+        raise ValueError('--fused_shuffle only applies to ShuffleV1')
+    if opt.teacher_cache is not None and opt.distill == 'crd':
+        raise ValueError('--teacher_cache cannot be used with --distill crd')
+    if opt.aug_seed is not None and opt.distill == 'crd':
+        # the crd sample loader draws its own unseeded augmentation
+        raise ValueError('--aug_seed cannot be used with --distill crd')
+    if opt.tensor_aug and opt.distill == 'crd':
+        # the crd sample loader only has the per-sample PIL path
+        raise ValueError('--tensor_aug cannot be used with --distill crd')
+    if opt.fused_shuffle and opt.population:
+        raise ValueError('--fused_shuffle cannot be used with the vmap-batched --population')
+    if opt.population and opt.distill not in ('kd', 'rkd'):
+        # semckd/crd carry trainable per-student heads that are not stacked into the population
+        raise ValueError('--population only supports --distill kd/rkd')
+    if len(opt.exc_groups.split(',')) < 2:
+        # after epoch 150 the exchanged group is drawn from the 2nd one on
+        raise ValueError('--exc_groups needs at least 2 layer groups')
+
     # set the path of model and tensorboard
     opt.model_path = './save/student_model_exc/formal_training/ShuffleV1_resnet32x4/'
     opt.tb_path = './save/student_tensorboards'
@@ -134,6 +176,9 @@ def parse_option():
 
     opt.model_t = get_teacher_name(opt.path_t)
 
+    # the train loader also yields (index, view) of each sample
+    opt.is_view = opt.teacher_cache is not None or opt.aug_seed is not None
+
     model_name_template = split_symbol.join(['S', '{}_T', '{}_{}_{}_{}_{}_r', '{}_a', '{}_b', '{}'])
     opt.model_name = model_name_template.format(opt.model_s, opt.model_t, opt.dataset, opt.trial, opt.mindex, opt.distill,
                                                 opt.gamma, opt.alpha, opt.beta)
@@ -181,6 +226,84 @@ def load_teacher(model_path, n_cls, gpu=None, opt=None):
     print('==> done')
     return model
 
+def train_population(opt, model_t, criterion_list, train_loader, val_loader, logger, module_args):
+    """genetic recombination over a vmap-batched population of opt.population students"""
+    students = [model_dict[opt.model_s](**module_args) for _ in range(opt.population)]
+    population = StudentPopulation(students)
+    # scratch model that each member is loaded into for validation
+    model_eval = students[0]
+    if torch.cuda.is_available():
+        population.cuda()
+        model_eval.cuda()
+
+    optimizer = optim.SGD(population.parameters(),
+                          lr=opt.learning_rate,
+                          momentum=opt.momentum,
+                          weight_decay=opt.weight_decay)
+
+    exc_groups = opt.exc_groups.split(',')
+    best_acc = [0] * opt.population
+    for epoch in range(1, opt.epochs + 1):
+        adjust_learning_rate(epoch, opt, optimizer)
+        if opt.is_view:
+            train_loader.dataset.set_epoch(epoch)
+        if epoch % opt.exc_epoch == 0:
+            random_number = random.randint(1 if epoch <= 150 else 2, len(exc_groups))
+            # pair the students at random, each pair exchanges the chosen layer group
+            order = torch.randperm(opt.population).tolist()
+            perm = list(range(opt.population))
+            for a, b in zip(order[0::2], order[1::2]):
+                perm[a], perm[b] = b, a
+            population.crossover(exc_groups[random_number - 1], perm, suffixes=('weight',))
+            row1 = {
+                'change parameter 选择交换层数为':str(random_number),
+                'pairs': str(perm),
+            }
+            print(row1)
+            logger.writerow(row1)
+
+        time1 = time.time()
+        results = train_distill_vmap(epoch, train_loader, population, model_t, criterion_list, optimizer, opt)
+        time2 = time.time()
+
+        for i, (train_acc, train_acc_top5, train_loss, data_time) in enumerate(results):
+            model_eval.load_state_dict(population.state_dict(i))
+            test_acc, test_acc_top5, test_loss = validate(val_loader, model_eval, criterion_list[0], opt)
+            row = { 'Epoch': str(epoch),
+            'Student': str(i + 1),
+            'TrainAcc@1': '%.3f'%(train_acc),
+            'TrainAcc@5': '%.3f'%(train_acc_top5),
+            'TestAcc@1': '%.3f'%(test_acc),
+            'TestAcc@5': '%.3f'%(test_acc_top5),
+            'Time': '%.2f'%(time2 - time1),
+            'lr': '%.5f'%(optimizer.param_groups[0]['lr']),
+            'Data': '%.2f'%(data_time),
+            }
+            print(row)
+            logger.writerow(row)
+
+            if test_acc > best_acc[i]:
+                best_acc[i] = test_acc
+                state = {
+                    'epoch': epoch,
+                    'model': model_eval.state_dict(),
+                    'best_acc': best_acc[i],
+                }
+                save_file = os.path.join(opt.save_folder, '{}_s{}_best.pth'.format(opt.model_s, i + 1))
+
+                test_merics = {'test_loss': test_loss,
+                                'test_acc': test_acc,
+                                'test_acc_top5': test_acc_top5,
+                                'epoch': epoch}
+
+                save_dict_to_json(test_merics, os.path.join(opt.save_folder, "test_s{}_best_metrics.json".format(i + 1)))
+                print('saving the best model!')
+                torch.save(state, save_file)
+
+    row = {'BestAcc@s{}'.format(i + 1): '%.3f'%(acc) for i, acc in enumerate(best_acc)}
+    print(row)
+    logger.writerow(row)
+
 total_time = time.time()
 best_acc1 = 0
 best_acc2 = 0
@@ -244,6 +367,9 @@ def main_worker(gpu, ngpus_per_node, opt):
     module_args = {'num_classes': n_cls}
     model_s1 = model_dict[opt.model_s](**module_args)
     model_s2 = model_dict[opt.model_s](**module_args)
+    if opt.fused_shuffle:
+        model_s1.fuse_shuffle()
+        model_s2.fuse_shuffle()
 
     
     if opt.dataset == 'cifar100':
@@ -296,7 +422,7 @@ def main_worker(gpu, ngpus_per_node, opt):
         trainable_list2.append(criterion_kd.embed_s)
         trainable_list2.append(criterion_kd.embed_t)
     elif opt.distill == 'rkd':
-        criterion_kd = RKDLoss()
+        criterion_kd = RKDLoss(angle_chunk=opt.rkd_chunk)
     else:
         raise NotImplementedError(opt.distill)
 
@@ -305,8 +431,13 @@ def main_worker(gpu, ngpus_per_node, opt):
     criterion_list.append(criterion_div)    # KL divergence loss, original knowledge distillation
     criterion_list.append(criterion_kd)     # other knowledge distillation loss
 
-    module_list1.append(model_t)
-    module_list2.append(model_t)
+    if opt.teacher_cache is None:
+        module_list1.append(model_t)
+        module_list2.append(model_t)
+    else:
+        teacher_cache = TeacherCache(opt.teacher_cache, opt.distill)
+        module_list1.append(teacher_cache)
+        module_list2.append(teacher_cache)
 # endregion
 
 # region Torch + Optimizer + Dataloater + Test_teacher 
@@ -354,10 +485,15 @@ def main_worker(gpu, ngpus_per_node, opt):
             train_loader, val_loader, n_data = get_cifar100_dataloaders_sample(batch_size=opt.batch_size,
                                                                                num_workers=opt.num_workers,
                                                                                k=opt.nce_k,
-                                                                               mode=opt.mode)
+                                                                               mode=opt.mode,
+                                                                               shared=opt.shared_data)
         else:
             train_loader, val_loader = get_cifar100_dataloaders(batch_size=opt.batch_size,
-                                                                        num_workers=opt.num_workers)
+                                                                        num_workers=opt.num_workers,
+                                                                        is_view=opt.is_view,
+                                                                        aug_seed=opt.aug_seed,
+                                                                        on_tensor=opt.tensor_aug,
+                                                                        shared=opt.shared_data)
     else:
         raise NotImplementedError(opt.dataset)
 
@@ -374,12 +510,18 @@ def main_worker(gpu, ngpus_per_node, opt):
     else:
         print('Skipping teacher validation.')
     # endregion
+
+    if opt.population > 0:
+        train_population(opt, module_list1[-1], criterion_list, train_loader, val_loader, logger, module_args)
+        return
     
     # routine
     Exc_index = 0
 
 
     exc_epoch =  opt.exc_epoch   
+    exc_layer_groups = {i + 1: layer_group_pairs(model_s1, model_s2, group, suffixes=('weight',))
+                        for i, group in enumerate(opt.exc_groups.split(','))}
     row1 = {
             '训练描述： [1,2,3] 150 [2,3] 240   layer1*2*3 的 weight, Exc_epoches为':str(exc_epoch)
             }      
@@ -396,581 +538,26 @@ def main_worker(gpu, ngpus_per_node, opt):
 
         now_lr = adjust_learning_rate(epoch, opt, optimizer1)
         adjust_learning_rate(epoch, opt, optimizer2)
+        if opt.is_view:
+            train_loader.dataset.set_epoch(epoch)
         if epoch % exc_epoch == 0:
             if epoch <= 150:
-                random_number = random.randint(1, 3)
+                random_number = random.randint(1, len(exc_layer_groups))
             elif epoch > 150:
-                random_number = random.randint(2, 3)
+                random_number = random.randint(2, len(exc_layer_groups))
             
-            if random_number == 1:
-                row1 = {
-                    'change parameter 选择交换层数为':str(random_number)
-                }
-                print(row1)
-                logger.writerow(row1)
-                layer_name = "conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.0.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.0.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer1.0.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.0.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer1.0.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.0.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer1.1.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.1.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer1.1.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.1.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer1.1.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.1.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer1.2.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.2.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer1.2.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.2.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer1.2.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.2.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer1.3.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.3.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer1.3.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.3.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer1.3.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer1.3.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-
-            if random_number == 2:
-                row1 = {
-                    'change parameter 选择交换层数为':str(random_number)
-                }
-                print(row1)
-                logger.writerow(row1)
-                layer_name = "layer2.0.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.0.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.0.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.0.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.0.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.0.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer2.1.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.1.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.1.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.1.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.1.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.1.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer2.2.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.2.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.2.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.2.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.2.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.2.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer2.3.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.3.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.3.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.3.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.3.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.3.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer2.4.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.4.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.4.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.4.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.4.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.4.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer2.5.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.5.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.5.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.5.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.5.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.5.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer2.6.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.6.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.6.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.6.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.6.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.6.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer2.7.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.7.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.7.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.7.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer2.7.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer2.7.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                
-
-            if random_number == 3:
-                row1 = {
-                    'change parameter 选择交换层数为':str(random_number)
-                }
-                print(row1)
-                logger.writerow(row1)
-                layer_name = "layer3.0.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.0.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer3.0.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.0.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer3.0.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.0.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer3.1.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.1.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer3.1.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.1.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer3.1.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.1.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer3.2.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.2.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer3.2.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.2.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer3.2.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.2.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "layer3.3.conv1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.3.bn1.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer3.3.conv2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.3.bn2.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ################
-                layer_name = "layer3.3.conv3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                layer_name = "layer3.3.bn3.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
-                ###############
-                layer_name = "linear.weight"
-                weights1 = model_s1.state_dict()[layer_name].clone()
-                weights2 = model_s2.state_dict()[layer_name].clone()
-                model_s1.state_dict()[layer_name].copy_(weights2)
-                model_s2.state_dict()[layer_name].copy_(weights1)
+            row1 = {
+                'change parameter 选择交换层数为':str(random_number)
+            }
+            print(row1)
+            logger.writerow(row1)
+            swap_tensor_pairs(exc_layer_groups[random_number])
             
 
         time1 = time.time()
-        train_acc1, train_acc1_top5, train_loss1, data_time1 = train(epoch, train_loader, module_list1, criterion_list, optimizer1, opt)
-        train_acc2, train_acc2_top5, train_loss2, data_time2 = train(epoch, train_loader, module_list2, criterion_list, optimizer2, opt)
+        (train_acc1, train_acc1_top5, train_loss1, data_time1), \
+            (train_acc2, train_acc2_top5, train_loss2, data_time2) = train_distill_population(
+                epoch, train_loader, [module_list1, module_list2], criterion_list, [optimizer1, optimizer2], opt)
 
         time2 = time.time()
 
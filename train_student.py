@@ -16,7 +16,6 @@ import torch.multiprocessing as mp
 import torch.distributed as dist
 import torch.nn as nn
 import torch.backends.cudnn as cudnn
-import tensorboard_logger as tb_logger
 
 # import apex
 
@@ -24,9 +23,8 @@ from models import model_dict
 from models.util import Embed, ConvReg, LinearEmbed, SelfA
 
 from dataset.cifar100 import get_cifar100_dataloaders, get_cifar100_dataloaders_sample
-from dataset.imagenet import get_imagenet_dataloader, imagenet_list
-from dataset.imagenet_dali import get_dali_data_loader
 
+from helper.teacher_cache import TeacherCache
 from helper.util import adjust_learning_rate, save_dict_to_json, reduce_tensor
 
 from distiller_zoo import DistillKL, RKDLoss, SemCKDLoss
@@ -77,6 +75,10 @@ def parse_option():
 
     # KL distillation
     parser.add_argument('--kd_T', type=float, default=4, help='temperature for KD distillation')
+    parser.add_argument('--teacher_cache', type=str, default=None,
+                        help='read teacher outputs from a cache written by precompute_teacher.py')
+    parser.add_argument('--aug_seed', type=int, default=None,
+                        help='draw crop/flip from a seeded per-(epoch, index) generator, replayable across runs')
 
     # NCE distillation
     parser.add_argument('--feat_dim', default=128, type=int, help='feature dimension')
@@ -84,6 +86,13 @@ def parse_option():
     parser.add_argument('--nce_k', default=16384, type=int, help='number of negative samples for NCE')
     parser.add_argument('--nce_t', default=0.07, type=float, help='temperature parameter for softmax')
     parser.add_argument('--nce_m', default=0.5, type=float, help='momentum for non-parametric updates')
+    parser.add_argument('--nce_bank_dtype', default='float32', type=str, choices=['float32', 'float16', 'bfloat16'],
+                        help='storage dtype of the CRD memory bank')
+    parser.add_argument('--nce_bank_path', default=None, type=str,
+                        help='keep the CRD memory bank in memory-mapped files in this directory')
+
+    # RKD distillation
+    parser.add_argument('--rkd_chunk', default=0, type=int, help='anchors per chunk of the RKD angle loss, 0 for no chunking')
 
     # hint layer
     parser.add_argument('--hint_layer', default=1, type=int, choices=[0, 1, 2, 3, 4])
@@ -96,6 +105,8 @@ def parse_option():
     parser.add_argument('--no_edge_transform', action='store_true') # default=false
     
     parser.add_argument('--use-lmdb', action='store_true') # default=false
+    parser.add_argument('--tensor_aug', action='store_true', help='augment whole batches on the uint8 array, no PIL/workers')
+    parser.add_argument('--shared_data', action='store_true', help='open CIFAR from the memory-mapped fast-start layout, shared by workers and trials')
 
     parser.add_argument('--dali', type=str, choices=['cpu', 'gpu'], default=None)
 
@@ -110,6 +121,8 @@ def parse_option():
     parser.add_argument('--deterministic', action='store_true', help='Make results reproducible')
 
     parser.add_argument('--skip-validation', action='store_true', help='Skip validation of teacher')
+    parser.add_argument('--fuse_eval', action='store_true', help='validate with the conv-BN pairs folded (helper.fuse.inference_fuse)')
+    parser.add_argument('--fused_shuffle', action='store_true', help='ShuffleV1: run relu + channel shuffle as one pass (same outputs)')
 
     parser.add_argument('--hkd_initial_weight', default=100, type=float, help='Initial layer weight for HKD method')
     parser.add_argument('--hkd_decay', default=0.7, type=float, help='Layer weight decay for HKD method')
@@ -120,6 +133,18 @@ def parse_option():
     if opt.model_s in ['MobileNetV2', 'ShuffleV1', 'ShuffleV2']:
         opt.learning_rate = 0.01
 
+    if opt.fused_shuffle and opt.model_s != 'ShuffleV1':
+        # ShuffleV2 already shuffles as one copy fused with its concat
+        raise ValueError('--fused_shuffle only applies to ShuffleV1')
+    if opt.teacher_cache is not None and opt.distill == 'crd':
+        raise ValueError('--teacher_cache cannot be used with --distill crd')
+    if opt.aug_seed is not None and opt.distill == 'crd':
+        # the crd sample loader draws its own unseeded augmentation
+        raise ValueError('--aug_seed cannot be used with --distill crd')
+    if opt.tensor_aug and opt.distill == 'crd':
+        # the crd sample loader only has the per-sample PIL path
+        raise ValueError('--tensor_aug cannot be used with --distill crd')
+
     # set the path of model and tensorboard
     opt.model_path = './save/student_model'
     opt.tb_path = './save/student_tensorboards'
@@ -131,6 +156,9 @@ def parse_option():
 
     opt.model_t = get_teacher_name(opt.path_t)
 
+    # the train loader also yields (index, view) of each sample
+    opt.is_view = opt.teacher_cache is not None or opt.aug_seed is not None
+
     model_name_template = split_symbol.join(['S', '{}_T', '{}_{}_{}_r', '{}_a', '{}_b', '{}_{}'])
     opt.model_name = model_name_template.format(opt.model_s, opt.model_t, opt.dataset, opt.distill,
                                                 opt.gamma, opt.alpha, opt.beta, opt.trial)
@@ -232,6 +260,8 @@ def main_worker(gpu, ngpus_per_node, opt):
     model_t = load_teacher(opt.path_t, n_cls, opt.gpu, opt)
     module_args = {'num_classes': n_cls}
     model_s = model_dict[opt.model_s](**module_args)
+    if opt.fused_shuffle:
+        model_s.fuse_shuffle()
     
     if opt.dataset == 'cifar100':
         data = torch.randn(2, 3, 32, 32)
@@ -269,7 +299,7 @@ def main_worker(gpu, ngpus_per_node, opt):
         trainable_list.append(criterion_kd.embed_s)
         trainable_list.append(criterion_kd.embed_t)
     elif opt.distill == 'rkd':
-        criterion_kd = RKDLoss()
+        criterion_kd = RKDLoss(angle_chunk=opt.rkd_chunk)
     else:
         raise NotImplementedError(opt.distill)
 
@@ -278,7 +308,10 @@ def main_worker(gpu, ngpus_per_node, opt):
     criterion_list.append(criterion_div)    # KL divergence loss, original knowledge distillation
     criterion_list.append(criterion_kd)     # other knowledge distillation loss
 
-    module_list.append(model_t)
+    if opt.teacher_cache is None:
+        module_list.append(model_t)
+    else:
+        module_list.append(TeacherCache(opt.teacher_cache, opt.distill))
     
     if torch.cuda.is_available():
         # For multiprocessing distributed, DistributedDataParallel constructor
@@ -313,21 +346,30 @@ def main_worker(gpu, ngpus_per_node, opt):
             train_loader, val_loader, n_data = get_cifar100_dataloaders_sample(batch_size=opt.batch_size,
                                                                                num_workers=opt.num_workers,
                                                                                k=opt.nce_k,
-                                                                               mode=opt.mode)
+                                                                               mode=opt.mode,
+                                                                               shared=opt.shared_data)
         else:
             train_loader, val_loader = get_cifar100_dataloaders(batch_size=opt.batch_size,
-                                                                        num_workers=opt.num_workers)
-    elif opt.dataset in imagenet_list:
+                                                                        num_workers=opt.num_workers,
+                                                                        is_view=opt.is_view,
+                                                                        aug_seed=opt.aug_seed,
+                                                                        on_tensor=opt.tensor_aug,
+                                                                        shared=opt.shared_data)
+    else:
+        # imagenet (and lmdb/DALI) readers are only imported when such a dataset is asked for
+        from dataset.imagenet import get_imagenet_dataloader, imagenet_list
+        if opt.dataset not in imagenet_list:
+            raise NotImplementedError(opt.dataset)
         if opt.dali is None:
             train_loader, val_loader, train_sampler = get_imagenet_dataloader(dataset=opt.dataset, batch_size=opt.batch_size,
                                                                         num_workers=opt.num_workers,
                                                                         multiprocessing_distributed=opt.multiprocessing_distributed)
         else:
+            from dataset.imagenet_dali import get_dali_data_loader
             train_loader, val_loader = get_dali_data_loader(opt)
-    else:
-        raise NotImplementedError(opt.dataset)
 
     if not opt.multiprocessing_distributed or opt.rank % ngpus_per_node == 0:
+        import tensorboard_logger as tb_logger
         logger = tb_logger.Logger(logdir=opt.tb_folder, flush_secs=2)
 
     if not opt.skip_validation:
@@ -350,6 +392,8 @@ def main_worker(gpu, ngpus_per_node, opt):
                 train_sampler.set_epoch(epoch)
 
         adjust_learning_rate(epoch, opt, optimizer)
+        if opt.is_view:
+            train_loader.dataset.set_epoch(epoch)
         print("==> training...")
 
         time1 = time.time()
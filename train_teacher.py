@@ -10,17 +10,14 @@ import torch.multiprocessing as mp
 import torch.distributed as dist
 import torch.nn as nn
 import torch.backends.cudnn as cudnn
-# import tensorboard_logger as tb_logger
 
 # import apex
 
 from models import model_dict
 
 from dataset.cifar100 import get_cifar100_dataloaders
-from dataset.imagenet import get_imagenet_dataloader, imagenet_list
 from helper.util import adjust_learning_rate, accuracy, AverageMeter, save_dict_to_json, reduce_tensor
 from helper.loops import train_vanilla as train, validate
-# from dataset.imagenet_dali import get_dali_data_loader
 
 def parse_option():
 
@@ -52,6 +49,10 @@ def parse_option():
     parser.add_argument('-t', '--trial', type=str, default='0', help='the experiment id')
 
     parser.add_argument('--use-lmdb', action='store_true') # default=false
+    parser.add_argument('--tensor_aug', action='store_true', help='augment whole batches on the uint8 array, no PIL/workers')
+    parser.add_argument('--shared_data', action='store_true', help='open CIFAR from the memory-mapped fast-start layout, shared by workers and trials')
+    parser.add_argument('--fuse_eval', action='store_true', help='validate with the conv-BN pairs folded (helper.fuse.inference_fuse)')
+    parser.add_argument('--fused_shuffle', action='store_true', help='ShuffleV1: run relu + channel shuffle as one pass (same outputs)')
 
     parser.add_argument('--dali', type=str, choices=['cpu', 'gpu'], default=None)
 
@@ -70,6 +71,10 @@ def parse_option():
     if opt.model in ['MobileNetV2', 'ShuffleV1', 'ShuffleV2']:
         opt.learning_rate = 0.01
 
+    if opt.fused_shuffle and opt.model != 'ShuffleV1':
+        # ShuffleV2 already shuffles as one copy fused with its concat
+        raise ValueError('--fused_shuffle only applies to ShuffleV1')
+
     # set the path of model and tensorboard 
     opt.model_path = './save/models'
     opt.tb_path = './save/tensorboard'
@@ -137,6 +142,8 @@ def main_worker(gpu, ngpus_per_node, opt):
     }.get(opt.dataset, None)
     
     model = model_dict[opt.model](num_classes=n_cls)
+    if opt.fused_shuffle:
+        model.fuse_shuffle()
 
     # optimizer
     optimizer = optim.SGD(model.parameters(),
@@ -177,20 +184,26 @@ def main_worker(gpu, ngpus_per_node, opt):
 
     # dataloader
     if opt.dataset == 'cifar100':
-        train_loader, val_loader = get_cifar100_dataloaders(batch_size=opt.batch_size, num_workers=opt.num_workers)
-    elif opt.dataset in imagenet_list:
+        train_loader, val_loader = get_cifar100_dataloaders(batch_size=opt.batch_size, num_workers=opt.num_workers,
+                                                            on_tensor=opt.tensor_aug,
+                                                            shared=opt.shared_data)
+    else:
+        # imagenet (and lmdb/DALI) readers are only imported when such a dataset is asked for
+        from dataset.imagenet import get_imagenet_dataloader, imagenet_list
+        if opt.dataset not in imagenet_list:
+            raise NotImplementedError(opt.dataset)
         if opt.dali is None:
             train_loader, val_loader, train_sampler = get_imagenet_dataloader(
                         dataset = opt.dataset,
                         batch_size=opt.batch_size, num_workers=opt.num_workers, use_lmdb=opt.use_lmdb,
                         multiprocessing_distributed=opt.multiprocessing_distributed)
         else:
+            from dataset.imagenet_dali import get_dali_data_loader
             train_loader, val_loader = get_dali_data_loader(opt)
-    else:
-        raise NotImplementedError(opt.dataset)
 
     # tensorboard
     if not opt.multiprocessing_distributed or opt.rank % ngpus_per_node == 0:
+        import tensorboard_logger as tb_logger
         logger = tb_logger.Logger(logdir=opt.tb_folder, flush_secs=2)
 
     # routine